@@ -1,48 +1,114 @@
-import os,time
-from groq import Groq
-from pydantic import BaseModel
+import os,re,time
+from concurrent.futures import Future
 from typing import List, Dict
-from prompts import extract_wisdom, clip_range_prompt  # Importing the necessary prompts
+from prompts import extract_wisdom, extract_wisdom_window, clip_range_prompt  # Importing the necessary prompts
 from Transcript import get_or_create_transcript
 from VectorDB import Faiss
+from LLMClient import AsyncLLMClient, Priority
 import json
 import copy,curses
 import pprint
 
 class AIEditor:
-    def __init__(self, api_key: str='', model: str = "llama-3.1-70b-versatile"):
-        self.client = Groq(api_key=api_key)
+    def __init__(self, api_key: str='', model: str = "llama-3.1-70b-versatile", base_url: str = None,
+                 max_concurrency: int = 8, window_chunks: int = 6, max_prompt_chars: int = 60000):
+        self.api_key = api_key
         self.faiss = Faiss()
         self.model = model
+        # Transcripts longer than max_prompt_chars are summarised window by
+        # window, each window spanning window_chunks VectorDB chunks
+        self.window_chunks = window_chunks
+        self.max_prompt_chars = max_prompt_chars
+        # Chunk id each extracted item came from, filled by extract_wisdom_chunked
+        self.topic_chunks = {}
+        # Rate-limited async client; base_url can point at a local mock server
+        self.llm = AsyncLLMClient(api_key=api_key, model=model, base_url=base_url, max_concurrency=max_concurrency)
+        # Priority of each pending generate_clip_ranges request, by topic
+        self.clip_priorities = {}
 
     def _generate_response(self, prompt: str, model: str = None, temperature: float = 0.7, max_tokens: int = 5000) -> str:
-        if model is None:
-            model = self.model
-
-        attempts = 5
-        for attempt in range(attempts):
-            try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    temperature=temperature,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt,
-                        },
-                    ],
-                )
-                return response.choices[0].message.content.strip()
-            except Exception as e:
-                if attempt < attempts - 1:
-                    time.sleep(5)
-                else:
-                    raise e
+        return self.llm.generate(prompt, model=model or self.model, temperature=temperature)
 
     def extract_wisdom(self, transcript_text: str) -> str:
         prompt = extract_wisdom.replace("{transcript_text}", transcript_text)
         return self._generate_response(prompt)
 
+    def _wisdom_windows(self) -> List[Dict]:
+        """
+        Group the current video's chunks into windows of ``window_chunks``.
+        Window text marks where each chunk's new entries begin with ``[C<id>]``,
+        so overlapping chunk text is only sent once.
+        """
+        windows = []
+        metadata, entries = self.faiss.metadata, self.faiss.entries
+        for start in range(0, len(metadata), self.window_chunks):
+            chunks = metadata[start:start + self.window_chunks]
+            parts, covered = [], chunks[0]['first']
+            for chunk in chunks:
+                new_entries = entries[max(covered, chunk['first']):chunk['last']]
+                covered = max(covered, chunk['last'])
+                if new_entries:
+                    parts.append(f"[C{chunk['id']}] " + " ".join(entry['text'] for entry in new_entries))
+            windows.append({
+                "chunk_ids": [chunk['id'] for chunk in chunks],
+                "start": chunks[0]['start'],
+                "end": chunks[-1]['end'],
+                "text": "\n".join(parts),
+            })
+        return windows
+
+    @staticmethod
+    def _dedupe_key(item: str) -> frozenset:
+        return frozenset(re.findall(r"[a-z0-9']+", item.lower()))
+
+    def extract_wisdom_chunked(self, ideas: int = 8, quotes: int = 4, stories: int = 3) -> str:
+        """
+        Map-reduce ``extract_wisdom`` for long transcripts: every window of the
+        current video's chunks is summarised concurrently, then the sections
+        are merged in time order with near-duplicate items dropped.
+
+        Each kept item's source chunk goes into ``self.topic_chunks``.
+
+        :return: Markdown in the same shape as ``extract_wisdom``, for ``gather_ideas_and_quotes``.
+        """
+        windows = self._wisdom_windows()
+        prompts = [
+            extract_wisdom_window.replace("{ideas}", str(ideas)).replace("{quotes}", str(quotes))
+            .replace("{stories}", str(stories)).replace("{transcript_text}", window["text"])
+            for window in windows
+        ]
+        print(f"Extracting wisdom from {len(windows)} transcript windows...")
+        replies = self.llm.submit(self.llm.complete_many(prompts, return_exceptions=True)).result()
+
+        merged, seen = {}, {}
+        for window, reply in zip(windows, replies):
+            if isinstance(reply, Exception):
+                print(f"Skipping window {window['start']:.0f}-{window['end']:.0f}s: {reply}")
+                continue
+            for section, items in self.gather_ideas_and_quotes(reply).items():
+                section = section.rstrip(":").strip().upper()
+                section_items = merged.setdefault(section, [])
+                section_keys = seen.setdefault(section, [])
+                for item in items:
+                    markers = re.findall(r"\[C(\d+)\]", item)
+                    item = re.sub(r"\s*\[C\d+\]", "", item).lstrip("- ").strip()
+                    key = self._dedupe_key(item)
+                    if not key:
+                        continue
+                    # Drop items sharing most of their words with an earlier one
+                    if any(len(key & other) >= 0.8 * len(key | other) for other in section_keys):
+                        continue
+                    section_keys.append(key)
+                    section_items.append(item)
+
+                    chunk_ids = [int(m) for m in markers if int(m) in window["chunk_ids"]]
+                    self.topic_chunks[item] = chunk_ids[0] if chunk_ids else window["chunk_ids"][0]
+
+        return "\n".join(
+            f"# {section}\n" + "\n".join(f"* {item}" for item in items)
+            for section, items in merged.items()
+        )
+
     def gather_ideas_and_quotes(self, markdown_text: str) -> Dict[str, List[str]]:
         lines = markdown_text.split("\n")
         organized_content = {}
@@ -59,9 +125,10 @@ class AIEditor:
 
         return organized_content
 
-    def generate_clip_range(self, neighbors_dict: Dict, topic: str, video_id: str) -> Dict[str, any]:
-        prompt = clip_range_prompt.replace("{neigbours-dict}", str(neighbors_dict)).replace("{topic}", topic)
-        clip_range_text = self._generate_response(prompt, model="llama-3.1-70b-versatile", temperature=0)
+    def _clip_range_prompt(self, neighbors_dict: Dict, topic: str) -> str:
+        return clip_range_prompt.replace("{neigbours-dict}", str(neighbors_dict)).replace("{topic}", topic)
+
+    def _clip_info(self, clip_range_text: str, neighbors_dict: Dict, video_id: str) -> Dict[str, any]:
         clip_range = eval(clip_range_text)
 
         start = neighbors_dict[clip_range[0]]['start']
@@ -76,34 +143,82 @@ class AIEditor:
             "youtube_link": youtube_link
         }
 
-    def process_transcript(self, video_id: str) -> Dict[str, List[str]]:
-        transcripts, transcript_text = get_or_create_transcript(video_id=video_id)
-        self.faiss.add_transcripts(json.loads(transcripts), video_id)
-        wisdom_markdown = self.extract_wisdom(transcript_text)
+    def generate_clip_range(self, neighbors_dict: Dict, topic: str, video_id: str) -> Dict[str, any]:
+        prompt = self._clip_range_prompt(neighbors_dict, topic)
+        clip_range_text = self._generate_response(prompt, model="llama-3.1-70b-versatile", temperature=0)
+        return self._clip_info(clip_range_text, neighbors_dict, video_id)
+
+    async def _generate_clip_range_async(self, neighbors_dict: Dict, topic: str, video_id: str,
+                                         priority: Priority = None) -> Dict[str, any]:
+        prompt = self._clip_range_prompt(neighbors_dict, topic)
+        clip_range_text = await self.llm.complete(prompt, model="llama-3.1-70b-versatile", temperature=0,
+                                                  priority=priority or 0)
+        return self._clip_info(clip_range_text, neighbors_dict, video_id)
+
+    def generate_clip_ranges(self, resolved: Dict[str, Dict[int, Dict]], video_id: str) -> Dict[str, Future]:
+        """
+        Start generating the clip range of every topic concurrently, within the LLM rate limits.
+        These run at background priority, so blocking calls such as ``generate_clip_range`` go first;
+        ``prioritize_clip_range`` moves one topic's request ahead once it is needed.
+
+        :param resolved: Search results per topic, from ``search_many_and_process``.
+        :return: A future per topic; ``result()`` gives the clip info or raises the LLM/parse error.
+        """
+        futures = {}
+        for topic, items_dict in resolved.items():
+            neighbors_dict = self.find_neighbors_for_selected_items(items_dict) if items_dict else None
+            if neighbors_dict:
+                priority = self.clip_priorities[topic] = Priority()
+                futures[topic] = self.llm.submit(
+                    self._generate_clip_range_async(neighbors_dict, topic, video_id, priority)
+                )
+        return futures
+
+    def prioritize_clip_range(self, topic: str):
+        """Serve a topic's pending ``generate_clip_ranges`` request ahead of the other prefetches."""
+        priority = self.clip_priorities.pop(topic, None)
+        if priority is not None:
+            self.llm.prioritize(priority)
+
+    def process_transcript(self, video_id: str, refresh: bool = False) -> Dict[str, List[str]]:
+        # refresh re-fetches the transcript and embeds only what was added since
+        transcripts, transcript_text = get_or_create_transcript(video_id=video_id, refresh=refresh)
+        self.faiss.add_transcripts(json.loads(transcripts), video_id, incremental=refresh)
+        self.topic_chunks = {}
+        if len(transcript_text) > self.max_prompt_chars:
+            wisdom_markdown = self.extract_wisdom_chunked()
+        else:
+            wisdom_markdown = self.extract_wisdom(transcript_text)
         return self.gather_ideas_and_quotes(wisdom_markdown)
 
     def search_and_process(self, query: str, k: int = 1) -> Dict[int, Dict]:
         if not isinstance(query, str):
             raise ValueError("The query must be a string.")
 
-        results = self.faiss.search(query, k=k)
-        all_items = []
-        filtered = []
-        for item in results:
-            all_items.append(item['metadata'])
-            temp_item = copy.deepcopy(item)
-            del temp_item['metadata']['original_transcripts']
-            filtered.append(temp_item['metadata'])
+        return self.search_many_and_process([query], k=k)[query]
 
-        items_dict = {i + 1: item for i, item in enumerate(all_items)}
-
-        # temp = {i + 1: item for i, item in enumerate(filtered)}
-
-        # print("\nItems Dictionary:")
-        # for i, item in temp.items():
-        #     print(f"{i}: {item['text']}")
+    def search_many_and_process(self, queries: List[str], k: int = 1) -> Dict[str, Dict[int, Dict]]:
+        """Resolve every query to its numbered search results in one batched search."""
+        queries = list(dict.fromkeys(queries))
+        results = self.faiss.search_many(queries, k=k)
+        return {
+            query: {i + 1: item['metadata'] for i, item in enumerate(items)}
+            for query, items in zip(queries, results)
+        }
 
-        return items_dict
+    def resolve_topics(self, topics: List[str]) -> Dict[str, Dict[int, Dict]]:
+        """
+        Like ``search_many_and_process`` with ``k=1``, but topics extracted by
+        ``extract_wisdom_chunked`` map straight to their source chunk, without a vector search.
+        """
+        resolved = {
+            topic: {1: self.faiss.chunk(self.topic_chunks[topic])}
+            for topic in topics if topic in self.topic_chunks
+        }
+        remaining = [topic for topic in topics if topic not in resolved]
+        if remaining:
+            resolved.update(self.search_many_and_process(remaining, k=1))
+        return resolved
 
     def find_neighbors_for_selected_items(self, items_dict: Dict[int, Dict]) -> Dict[int, Dict]:
         # print("\nSelect an item number to find neighbors (or 'q' to quit):")
@@ -119,9 +234,13 @@ class AIEditor:
                 return None
 
             selected_item = items_dict[item_number]
-            neighbors = self.faiss.find_neighbors(selected_item)
+            try:
+                neighbors = self.faiss.find_neighbors(selected_item)
+            except ValueError:
+                print("The selected item is not part of the current video.")
+                return None
 
-            combined_transcripts = selected_item['original_transcripts']
+            combined_transcripts = list(selected_item['original_transcripts'])
             for neighbor in neighbors:
                 combined_transcripts.extend(neighbor['original_transcripts'])
 
@@ -0,0 +1,499 @@
+"""
+Benchmarks for the VividCut-AI pipelines.
+
+Runs entirely offline on synthetic inputs and prints machine-readable JSON,
+so results can be compared across commits:
+
+    python Benchmark.py cropping --lengths 10 60 --resolutions 640x360 1280x720
+    python Benchmark.py embeddings --minutes 180 --batch-sizes 8 32
+    python Benchmark.py recall --vectors 100000 --index-types sq16 sq8 ivfpq
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its largest finished child, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": own / 1024, "children": children / 1024}
+
+
+class DiskUsageMonitor:
+    """Poll the size of a set of paths in the background and remember the peak."""
+
+    def __init__(self, paths, interval=0.2):
+        self.paths = paths
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _size(self):
+        total = 0
+        for path in self.paths:
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+            elif os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    for name in files:
+                        try:
+                            total += os.path.getsize(os.path.join(root, name))
+                        except OSError:
+                            pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self._size())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self._size())
+
+
+def synthetic_video(path, width, height, seconds, fps=25, shot_length=8):
+    """
+    Write a synthetic talking-head style clip: a static "speaker" (head and
+    torso) on one side, a second one drifting across, and a background color
+    change every ``shot_length`` seconds to give scene cuts.
+    """
+    if os.path.exists(path):
+        return path
+    encoder = subprocess.Popen(
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0",
+            "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-g", str(fps * 2), "-c:a", "aac", "-shortest",
+            path,
+        ],
+        stdin=subprocess.PIPE,
+    )
+    rng = np.random.default_rng(0)
+    palette = rng.integers(30, 200, size=(64, 3))
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    unit = height / 10
+
+    def person(x):
+        head = (int(x), int(3 * unit))
+        cv2.circle(frame, head, int(1.2 * unit), (224, 172, 105), -1)
+        cv2.rectangle(
+            frame,
+            (int(x - 2 * unit), int(4.5 * unit)),
+            (int(x + 2 * unit), height),
+            (40, 60, 160),
+            -1,
+        )
+
+    try:
+        for i in range(int(seconds * fps)):
+            t = i / fps
+            frame[:] = palette[int(t // shot_length) % len(palette)]
+            person(width * 0.3)
+            person(width * (0.55 + 0.3 * np.sin(t / 3)))
+            encoder.stdin.write(frame.data)
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+    return path
+
+
+def _report(results, function, args):
+    try:
+        results.put((True, function(*args)))
+    except BaseException as e:
+        results.put((False, e))
+
+
+def run_isolated(function, *args):
+    """
+    Run ``function(*args)`` in a fresh spawned process and return its result,
+    so peak RSS is per case. The process is not a daemon, so the case can
+    start worker pools of its own.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_report, args=(results, function, args))
+    process.start()
+    try:
+        while True:
+            try:
+                ok, value = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive() and results.empty():
+                    raise RuntimeError(f"Benchmark case exited with code {process.exitcode}")
+    finally:
+        process.join()
+    if not ok:
+        raise value
+    return value
+
+
+def _cropping_case(video, options):
+    # Pipeline progress messages go to stderr so stdout stays pure JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        return _run_cropping_case(video, options)
+
+
+def _run_cropping_case(video, options):
+    from Cropping import VideoProcessor, YOLOModel
+    from Decoding import FrameReader, probe_video
+
+    work_dir = options["work_dir"]
+    temp_dir = os.path.join(work_dir, "temp")
+    output_video = os.path.join(work_dir, "output.mp4")
+    info = probe_video(video)
+    interval = int(1 / options["sample_rate"])
+    result = {
+        "video": os.path.basename(video),
+        "width": info["width"],
+        "height": info["height"],
+        "duration": info["duration"],
+        "frames": int(info["fps"] * info["duration"]),
+    }
+
+    start = time.perf_counter()
+    model = YOLOModel(
+        model_name=options["model"],
+        input_size=options["input_size"],
+        threads=options["threads"],
+    )
+    result["model_load_s"] = time.perf_counter() - start
+
+    processor = VideoProcessor(
+        model,
+        temp_dir=temp_dir,
+        batch_size=options["batch_size"],
+        detect_width=options["detect_width"],
+        adaptive=options["adaptive"],
+        cache_dir=None,
+        workers=options["workers"],
+    )
+    stages = {}
+
+    start = time.perf_counter()
+    reader = FrameReader(video, sample_interval=interval, width=options["detect_width"])
+    decoded = sum(1 for _ in reader)
+    elapsed = time.perf_counter() - start
+    stages["decode"] = {
+        "seconds": elapsed,
+        "frames": decoded,
+        "fps": decoded / elapsed,
+        "source_fps": result["frames"] / elapsed,
+    }
+
+    start = time.perf_counter()
+    segments = processor.segment_video(video, interval)
+    elapsed = time.perf_counter() - start
+    stages["detection"] = {
+        "seconds": elapsed,
+        "frames": len(segments),
+        "fps": len(segments) / elapsed,
+        "source_fps": result["frames"] / elapsed,
+    }
+
+    start = time.perf_counter()
+    plan = processor.planner.plan(segments, info["width"])
+    stages["plan"] = {"seconds": time.perf_counter() - start, "entries": len(plan)}
+
+    with DiskUsageMonitor([temp_dir, output_video]) as disk:
+        start = time.perf_counter()
+        processor.renderer.render(video, output_video, plan)
+        elapsed = time.perf_counter() - start
+    stages["render"] = {
+        "seconds": elapsed,
+        "frames": result["frames"],
+        "fps": result["frames"] / elapsed,
+        "peak_disk_mb": disk.peak_bytes / 2**20,
+    }
+
+    if options["workers"] > 1:
+        with DiskUsageMonitor([temp_dir, output_video]) as disk:
+            start = time.perf_counter()
+            processor.process_video(video, output_video, sample_rate=options["sample_rate"])
+            elapsed = time.perf_counter() - start
+        stages["process_video"] = {
+            "seconds": elapsed,
+            "workers": options["workers"],
+            "fps": result["frames"] / elapsed,
+            "peak_disk_mb": disk.peak_bytes / 2**20,
+        }
+
+    result["output_mb"] = os.path.getsize(output_video) / 2**20
+    result["stages"] = stages
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def bench_cropping(args):
+    video_dir = os.path.join(args.work_dir, "videos")
+    os.makedirs(video_dir, exist_ok=True)
+    options = {
+        "model": args.model,
+        "input_size": args.input_size,
+        "threads": args.threads,
+        "batch_size": args.batch_size,
+        "detect_width": args.detect_width,
+        "sample_rate": args.sample_rate,
+        "adaptive": args.adaptive,
+        "workers": args.workers,
+    }
+
+    cases = []
+    for resolution in args.resolutions:
+        width, height = (int(v) for v in resolution.split("x"))
+        for seconds in args.lengths:
+            video = synthetic_video(
+                os.path.join(video_dir, f"synthetic_{width}x{height}_{seconds}s.mp4"),
+                width,
+                height,
+                seconds,
+            )
+            case_dir = os.path.join(args.work_dir, f"case_{width}x{height}_{seconds}s")
+            shutil.rmtree(case_dir, ignore_errors=True)
+            os.makedirs(case_dir)
+            cases.append(run_isolated(_cropping_case, video, dict(options, work_dir=case_dir)))
+            shutil.rmtree(case_dir, ignore_errors=True)
+    return {"options": options, "cases": cases}
+
+
+def synthetic_transcript(minutes, seed=0):
+    """Caption entries shaped like youtube_transcript_api output, with random words."""
+    rng = np.random.default_rng(seed)
+    vocabulary = [
+        "video", "editing", "idea", "people", "learning", "future", "model", "story",
+        "because", "really", "think", "about", "question", "answer", "world", "time",
+        "important", "technology", "build", "human", "simple", "problem", "creative",
+    ]
+    entries, start = [], 0.0
+    while start < minutes * 60:
+        duration = float(rng.uniform(2, 6))
+        words = rng.choice(vocabulary, size=int(rng.integers(6, 16)))
+        entries.append({"text": " ".join(words), "start": start, "duration": duration})
+        start += duration
+    return entries
+
+
+def _embedding_case(options):
+    with contextlib.redirect_stdout(sys.stderr):
+        from VectorDB import Faiss, chunk_text
+
+        os.chdir(options["work_dir"])
+        db = Faiss(
+            model_name=options["model"],
+            batch_size=options["batch_size"],
+            exact_padding=options["exact_padding"],
+            num_threads=options["threads"],
+        )
+        transcript = synthetic_transcript(options["minutes"])
+        chunks = db._chunk_transcript(transcript)
+        texts = [chunk_text(transcript[chunk['first']:chunk['last']]) for chunk in chunks]
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        embeddings = db._create_embeddings(texts)
+        result = {
+            "batch_size": options["batch_size"],
+            "exact_padding": options["exact_padding"],
+            "chunks": len(texts),
+            "seconds": time.perf_counter() - wall_start,
+            "cpu_seconds": time.process_time() - cpu_start,
+            "peak_rss_mb": peak_rss_mb()["self"],
+        }
+        result["chunks_per_s"] = len(texts) / result["seconds"]
+        return result, embeddings
+
+
+def bench_embeddings(args):
+    base = {
+        "model": args.model,
+        "minutes": args.minutes,
+        "threads": args.threads,
+        "work_dir": os.path.abspath(args.work_dir),
+    }
+    # The single forward pass the embedding code used before batching
+    configs = [dict(base, batch_size=10**6, exact_padding=True)]
+    for batch_size in args.batch_sizes:
+        configs.append(dict(base, batch_size=batch_size, exact_padding=True))
+        configs.append(dict(base, batch_size=batch_size, exact_padding=False))
+
+    cases, reference = [], None
+    for config in configs:
+        result, embeddings = run_isolated(_embedding_case, config)
+        if reference is None:
+            reference = embeddings
+            result["baseline"] = True
+        result["max_abs_diff"] = float(np.abs(embeddings - reference).max())
+        cases.append(result)
+    return {"options": base, "cases": cases}
+
+
+def synthetic_vectors(count, dim, clusters=64, seed=0):
+    """Clustered, unit-length vectors, closer to sentence embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def library_vectors(base_dir):
+    from VectorDB import LIBRARY_DIR, has_video_data, read_embeddings
+
+    folders = [
+        os.path.join(base_dir, name) for name in sorted(os.listdir(base_dir))
+        if name != LIBRARY_DIR and has_video_data(os.path.join(base_dir, name))
+    ]
+    return np.concatenate([np.asarray(read_embeddings(folder)) for folder in folders])
+
+
+def bench_recall(args):
+    import faiss
+    from VectorDB import RerankIndex, new_compressed_index
+
+    if args.embeddings_dir:
+        vectors = library_vectors(args.embeddings_dir)
+    else:
+        vectors = synthetic_vectors(args.vectors + args.queries, args.dim)
+    rng = np.random.default_rng(1)
+    is_query = np.zeros(len(vectors), dtype=bool)
+    is_query[rng.choice(len(vectors), size=min(args.queries, len(vectors) // 10), replace=False)] = True
+    queries, base = vectors[is_query], np.ascontiguousarray(vectors[~is_query])
+    k = args.k
+
+    flat = faiss.IndexFlatL2(base.shape[1])
+    flat.add(base)
+    start = time.perf_counter()
+    _, truth = flat.search(queries, k)
+    flat_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    cases = [{
+        "index_type": "flat",
+        "rerank_factor": 0,
+        "bytes_per_vector": base.shape[1] * 4,
+        "compression": 1.0,
+        "recall_at_k": 1.0,
+        "ms_per_query": flat_ms,
+    }]
+    for index_type in args.index_types:
+        start = time.perf_counter()
+        index = new_compressed_index(index_type, base, pq_m=args.pq_m)
+        index.add(base)
+        build_seconds = time.perf_counter() - start
+        bytes_per_vector = len(faiss.serialize_index(index)) / len(base)
+
+        for rerank_factor in sorted({0, args.rerank_factor}):
+            searcher = RerankIndex(index, base, rerank_factor, index_type)
+            start = time.perf_counter()
+            _, found = searcher.search(queries, k)
+            seconds = time.perf_counter() - start
+            hits = sum(len(np.intersect1d(a, b)) for a, b in zip(found, truth))
+            cases.append({
+                "index_type": index_type,
+                "rerank_factor": rerank_factor,
+                "bytes_per_vector": bytes_per_vector,
+                "compression": base.shape[1] * 4 / bytes_per_vector,
+                "recall_at_k": hits / (k * len(queries)),
+                "ms_per_query": 1000 * seconds / len(queries),
+                "build_seconds": build_seconds,
+            })
+    options = {"vectors": len(base), "queries": len(queries), "dim": base.shape[1], "k": k,
+               "source": args.embeddings_dir or "synthetic"}
+    return {"options": options, "cases": cases}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--work-dir", default="bench_data")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    subparsers = parser.add_subparsers(dest="suite", required=True)
+
+    cropping = subparsers.add_parser("cropping", help="Decode, detection and render throughput of VideoProcessor")
+    cropping.add_argument("--lengths", type=int, nargs="+", default=[10, 60], help="Clip lengths in seconds")
+    cropping.add_argument("--resolutions", nargs="+", default=["640x360", "1280x720"])
+    cropping.add_argument("--model", default="yolov5nu.pt", help="Local weights or .onnx model")
+    cropping.add_argument("--input-size", type=int)
+    cropping.add_argument("--threads", type=int)
+    cropping.add_argument("--batch-size", type=int, default=16)
+    cropping.add_argument("--detect-width", type=int)
+    cropping.add_argument("--sample-rate", type=float, default=0.1)
+    cropping.add_argument("--adaptive", action="store_true")
+    cropping.add_argument("--workers", type=int, default=1)
+    cropping.set_defaults(run=bench_cropping)
+
+    embeddings = subparsers.add_parser("embeddings", help="Memory and CPU time of Faiss._create_embeddings")
+    embeddings.add_argument("--model", default="Alibaba-NLP/gte-large-en-v1.5", help="Locally cached model")
+    embeddings.add_argument("--minutes", type=int, default=60, help="Length of the synthetic transcript")
+    embeddings.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32])
+    embeddings.add_argument("--threads", type=int)
+    embeddings.set_defaults(run=bench_embeddings)
+
+    recall = subparsers.add_parser("recall", help="Recall@k and size of compressed vector indexes against exact search")
+    recall.add_argument("--vectors", type=int, default=50000, help="Number of synthetic vectors")
+    recall.add_argument("--queries", type=int, default=500)
+    recall.add_argument("--dim", type=int, default=1024)
+    recall.add_argument("--embeddings-dir", help="Use the stored vectors of every video in this directory instead")
+    recall.add_argument("--index-types", nargs="+", default=["sq16", "sq8", "ivfpq"])
+    recall.add_argument("--k", type=int, default=5)
+    recall.add_argument("--rerank-factor", type=int, default=4)
+    recall.add_argument("--pq-m", type=int, default=256)
+    recall.set_defaults(run=bench_recall)
+
+    args = parser.parse_args(argv)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    report = {
+        "suite": args.suite,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    report.update(args.run(args))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,28 @@ import sys
 from typing import Dict, List
 from AIEditor import AIEditor  # Assuming AIEditor is defined in a separate module
 from _utils import download_video_segments  # Importing the download function
+from MediaCache import MediaCache
 from Cropping import VideoProcessor, YOLOModel  # Importing the video processing classes
 
 class CLI:
-    def __init__(self, ai_editor: AIEditor, cache_file: str = "llm_cache.json"):
+    def __init__(self, ai_editor: AIEditor, cache_file: str = "llm_cache.json", range_downloads: bool = True):
         self.ai_editor = ai_editor
         self.cache_file = cache_file
         self.llm_cache = self.load_cache()
-        self.model = YOLOModel()  # Initialize the YOLO model
-        self.video_processor = VideoProcessor(self.model)  # Initialize video processor
+        self.media_cache = MediaCache()
+        self.range_downloads = range_downloads
+        self._video_processor = None
+
+    @property
+    def video_processor(self) -> VideoProcessor:
+        """Video processor, built the first time a clip is rendered."""
+        if self._video_processor is None:
+            self._video_processor = VideoProcessor(YOLOModel())
+        return self._video_processor
+
+    @property
+    def model(self) -> YOLOModel:
+        return self.video_processor.model
 
     def load_cache(self) -> Dict[str, str]:
         """Loads the cached LLM responses from a JSON file."""
@@ -137,7 +150,10 @@ class CLI:
         # Step 1: Download the video
         video_filename = "downloaded_video"
         print(f"\nDownloading segments video from {video_url}...")
-        files=download_video_segments(video_url, segments,video_filename)
+        files=download_video_segments(
+            video_url, segments, video_filename,
+            range_only=self.range_downloads, cache=self.media_cache
+        )
 
         for file in files:
             # Optionally, combine the clips into a final video
@@ -173,6 +189,12 @@ class CLI:
             print("Failed to process transcript.")
             return
 
+        # Resolve every topic in the menu to its best chunk upfront
+        topics = [topic for section in wisdom_json.values() for topic in section]
+        resolved = self.ai_editor.resolve_topics(topics)
+        # ...and ask the LLM for all their clip ranges in the background
+        clip_futures = self.ai_editor.generate_clip_ranges(resolved, video_id)
+
         while True:
             selected_topic = self.select_topic_from_wisdom(wisdom_json)
             if not selected_topic:
@@ -186,7 +208,9 @@ class CLI:
                 response = cached_response
             else:
                 print(f"\nSearching for relevant content for topic: '{selected_topic}'")
-                response = self.ai_editor.search_and_process(selected_topic, k=1)
+                response = resolved.get(selected_topic)
+                if response is None:
+                    response = self.ai_editor.search_and_process(selected_topic, k=1)
                 if response:
                     self.cache_llm_response(selected_topic, response)
                 else:
@@ -197,7 +221,17 @@ class CLI:
             neighbors_dict = self.ai_editor.find_neighbors_for_selected_items(items_dict)
 
             if neighbors_dict:
-                clip_info = self.ai_editor.generate_clip_range(neighbors_dict, selected_topic, video_id)
+                clip_info = None
+                future = clip_futures.pop(selected_topic, None)
+                if future is not None:
+                    # Move the prefetch ahead of the others rather than asking again
+                    self.ai_editor.prioritize_clip_range(selected_topic)
+                    try:
+                        clip_info = future.result()
+                    except Exception as e:
+                        print(f"Precomputed clip range failed ({e}), asking again.")
+                if clip_info is None:
+                    clip_info = self.ai_editor.generate_clip_range(neighbors_dict, selected_topic, video_id)
                 if clip_info:
                     print("\nGenerated Clip Information:")
                     print(f"Start Time: {clip_info['start_time']} seconds")
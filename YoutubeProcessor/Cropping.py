@@ -1,135 +1,346 @@
 import cv2
-import gc
-import torch
 import numpy as np
-from moviepy.editor import (
-    VideoFileClip,
-    concatenate_videoclips,
-    CompositeVideoClip,
-    vfx,
-)
 from tqdm import tqdm
 import os
-from ultralytics import YOLO
+import multiprocessing
+from OnnxDetector import OnnxYOLO
+from Decoding import FrameReader, keyframe_times, probe_video
+from DetectionCache import DetectionCache
+from Planning import LayoutPlanner
+from Rendering import FFmpegRenderer
+from SceneDetection import SceneCutDetector
+
+
+# Decode width used to scan every frame in adaptive mode when detect_width is unset
+ADAPTIVE_SCAN_WIDTH = 640
 
 
 class YOLOModel:
-    def __init__(self):
-        self.model = YOLO("yolov5nu.pt")
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model.to(self.device)
-        print(f"Using device: {self.device}")
+    """
+    YOLO detector.
+
+    :param model_name: ultralytics weights (``.pt``) or an exported ``.onnx``
+        model (float or int8), the latter run with onnxruntime on CPU.
+    :param input_size: If set, frames are downscaled so their long side is at
+        most this many pixels before inference; boxes are mapped back to the
+        original frame coordinates.
+    :param threads: Intra-op CPU threads for inference (torch or onnxruntime).
+
+    The weights (and torch/ultralytics) are only loaded on the first detection.
+    """
+
+    def __init__(self, model_name="yolov5nu.pt", conf_threshold=0.7, input_size=None, threads=None):
+        self.model_name = model_name
+        self.conf_threshold = conf_threshold
+        self.input_size = input_size
+        self.threads = threads
+        self.device = None
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            if str(self.model_name).endswith(".onnx"):
+                self._model = OnnxYOLO(
+                    self.model_name, imgsz=self.input_size or 640, threads=self.threads
+                )
+                self.device = "cpu (onnxruntime)"
+            else:
+                import torch
+                from ultralytics import YOLO
+
+                if self.threads:
+                    torch.set_num_threads(self.threads)
+                self._model = YOLO(self.model_name)
+                self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                self._model.to(self.device)
+            print(f"Using device: {self.device}")
+        return self._model
+
+    def config(self):
+        """Constructor arguments, used to build an identical model in worker processes."""
+        return {
+            "model_name": self.model_name,
+            "conf_threshold": self.conf_threshold,
+            "input_size": self.input_size,
+            "threads": self.threads,
+        }
 
     def detect(self, frame):
-        results = self.model(frame, verbose=False)
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        confidences = results[0].boxes.conf.cpu().numpy()
-        return [(box, conf) for box, conf in zip(boxes, confidences) if conf > .7]
+        return self.detect_batch([frame])[0]
+
+    def _downscale(self, frame):
+        height, width = frame.shape[:2]
+        if not self.input_size or max(height, width) <= self.input_size:
+            return frame, np.ones(4)
+        ratio = self.input_size / max(height, width)
+        size = (max(1, int(round(width * ratio))), max(1, int(round(height * ratio))))
+        resized = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        sx, sy = size[0] / width, size[1] / height
+        return resized, np.array([sx, sy, sx, sy])
+
+    def _infer(self, frames):
+        if isinstance(self.model, OnnxYOLO):
+            return self.model(frames)
+
+        options = {}
+        if self.input_size:
+            options["imgsz"] = -(-self.input_size // 32) * 32
+        results = self.model(frames, verbose=False, **options)
+        return [
+            (
+                result.boxes.xyxy.cpu().numpy().reshape(-1, 4),
+                result.boxes.conf.cpu().numpy().reshape(-1),
+            )
+            for result in results
+        ]
+
+    def detect_batch(self, frames):
+        """
+        Run detection on a list of frames in a single model call.
+
+        :param frames: List of HxWx3 frames.
+        :return: One list of (box, confidence) pairs per frame, in input order.
+        """
+        if not frames:
+            return []
+        inputs, scales = zip(*(self._downscale(frame) for frame in frames))
+        outputs = self._infer(list(inputs))
+
+        counts = [len(confidences) for _, confidences in outputs]
+        boxes = np.concatenate(
+            [frame_boxes / scale for (frame_boxes, _), scale in zip(outputs, scales)]
+        )
+        confidences = np.concatenate([frame_confidences for _, frame_confidences in outputs])
+        owners = np.repeat(np.arange(len(outputs)), counts)
+
+        # Filter the whole batch at once, then split back per frame
+        keep = confidences > self.conf_threshold
+        detections = [[] for _ in outputs]
+        for owner, box, conf in zip(owners[keep], boxes[keep], confidences[keep]):
+            detections[owner].append((box, conf))
+        return detections
 
 
 class VideoProcessor:
-    def __init__(self, model, temp_dir="temp_clips"):
+    def __init__(
+        self,
+        model,
+        temp_dir="temp_clips",
+        batch_size=16,
+        detect_width=None,
+        renderer=None,
+        planner=None,
+        adaptive=False,
+        fallback_interval=50,
+        scene_detector=None,
+        cache_dir="detection_cache",
+        workers=1,
+    ):
         self.model = model
         self.detections = []
         self.temp_dir = temp_dir
+        self.batch_size = batch_size
+        self.detect_width = detect_width
+        self.renderer = renderer or FFmpegRenderer()
+        self.planner = planner or LayoutPlanner()
+        self.adaptive = adaptive
+        self.fallback_interval = fallback_interval
+        self.scene_detector = scene_detector or SceneCutDetector()
+        self.cache = DetectionCache(cache_dir) if cache_dir else None
+        self.workers = max(1, int(workers))
         os.makedirs(temp_dir, exist_ok=True)
 
     def process_video(self, input_video, output_video, sample_rate=0.1):
-        video = VideoFileClip(input_video)
-        total_frames = int(video.fps * video.duration)
         frame_sample_interval = int(1 / sample_rate)
+        if self.workers > 1:
+            self._process_sharded(input_video, output_video, frame_sample_interval)
+        else:
+            self.render_range(input_video, output_video, frame_sample_interval)
+
+    def render_range(
+        self,
+        input_video,
+        output_video,
+        frame_sample_interval,
+        start_frame=0,
+        end_frame=None,
+        audio=True,
+    ):
+        segments = self.segment_video(
+            input_video, frame_sample_interval, start_frame, end_frame
+        )
+        frame_width = probe_video(input_video)["width"]
+        plan = self.planner.plan(segments, frame_width)
+        print(f"Planned {len(plan)} render segments from {len(segments)} windows")
+        self.renderer.render(
+            input_video, output_video, plan, start_frame, end_frame, audio=audio
+        )
 
-        target_ratio = 9 / 16
-        new_height = int(video.w / target_ratio)
-
-        clips = []
-        segment_index = 0
-        chunks = []
-        segments = list(self.segment_video(video, frame_sample_interval, total_frames))
-        no_segments = len(segments)
-
-        for segment in tqdm(segments, desc="Processing video"):
-            clip = video.subclip(segment["start"], segment["end"])
-            detections = segment["detections"]
-            # print(detections)
+    def _process_sharded(self, input_video, output_video, frame_sample_interval):
+        info = probe_video(input_video)
+        total_frames = int(info["fps"] * info["duration"])
+        boundaries = shard_boundaries(
+            keyframe_times(input_video), info["fps"], total_frames, self.workers
+        )
+        shards = [
+            (
+                input_video,
+                os.path.join(self.temp_dir, f"shard_{i:04d}.mp4"),
+                frame_sample_interval,
+                start,
+                end,
+            )
+            for i, (start, end) in enumerate(zip(boundaries, boundaries[1:]))
+        ]
+        print(f"Rendering {len(shards)} shards on {self.workers} workers")
+
+        options = {
+            "temp_dir": self.temp_dir,
+            "batch_size": self.batch_size,
+            "detect_width": self.detect_width,
+            "renderer": self.renderer,
+            "planner": self.planner,
+            "adaptive": self.adaptive,
+            "fallback_interval": self.fallback_interval,
+            "scene_detector": self.scene_detector,
+            "cache_dir": self.cache.cache_dir if self.cache else None,
+        }
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            self.workers,
+            initializer=_init_shard_worker,
+            initargs=(self.model.config(), options, self.workers),
+        ) as pool:
+            shard_files = pool.map(_render_shard, shards, chunksize=1)
+
+        try:
+            self.renderer.concat(shard_files, input_video, output_video)
+        finally:
+            for shard_file in shard_files:
+                os.remove(shard_file)
+
+    def segment_video(self, input_video, frame_sample_interval, start_frame=0, end_frame=None):
+        if self.adaptive:
+            reader = FrameReader(
+                input_video,
+                width=self.detect_width or ADAPTIVE_SCAN_WIDTH,
+                start_frame=start_frame,
+                end_frame=end_frame,
+            )
+            signature = (
+                "adaptive",
+                reader.size[0],
+                self.fallback_interval,
+                self.scene_detector.threshold,
+                self.scene_detector.thumb_size,
+                reader.start_frame,
+                reader.end_frame,
+            )
+        else:
+            reader = FrameReader(
+                input_video,
+                sample_interval=frame_sample_interval,
+                width=self.detect_width,
+                start_frame=start_frame,
+                end_frame=end_frame,
+            )
+            signature = ("fixed", frame_sample_interval, reader.start_frame, reader.end_frame)
+
+        cache_key = None
+        entry = {"detections": {}, "samples": {}}
+        if self.cache is not None:
+            cache_key = self.cache.key(
+                input_video,
+                self.model.config(),
+                reader.size[0] if reader.size != reader.source_size else None,
+            )
+            entry = self.cache.load(cache_key)
+        known = entry["detections"]
+
+        # Frames actually decoded last time; the stream can end before the
+        # container duration that reader.indices is derived from
+        indices = entry["samples"].get(signature)
+        if indices is None or any(index not in known for index in indices):
+            indices = self._detect_frames(reader, known)
+            entry["samples"][signature] = indices
+            if cache_key is not None:
+                self.cache.save(cache_key, entry)
+        else:
+            print(f"Reusing cached detections for {len(indices)} frames")
 
-            if len(detections) == 1:
-                processed_clip = self._process_single_face(
-                    clip, detections[0][0], new_height
-                )
-            elif len(detections) >= 2:
-                processed_clip = self._process_two_faces(
-                    clip, [d[0] for d in detections[:2]], new_height
-                )
-            else:
-                processed_clip = self._process_center_clip(clip, new_height)
-
-            chunks.append(processed_clip)
-            if len(chunks) % 20 == 0 or segments.index(segment) + 1 == no_segments:
-                chunked_video = concatenate_videoclips(chunks)
-                chunk_file = os.path.join(self.temp_dir, f"clip_{segment_index}.mp4")
-                chunked_video.write_videofile(chunk_file, audio_codec="aac")
-                chunked_video.close()
-                segment_index += 1
-                chunks = []
-                clips.append(chunk_file)
-
-            del clip, processed_clip
-            gc.collect()
-
-        collection = [VideoFileClip(clip) for clip in clips]
-        final_video = concatenate_videoclips(collection)
-        final_video.write_videofile(output_video, audio_codec="aac")
-        final_video.close()
-
-    def segment_video(self, video, frame_sample_interval, total_frames):
         segments = []
-        for i in tqdm(
-            range(0, total_frames, frame_sample_interval), desc="Generating segments"
-        ):
-            t = i / video.fps
-            frame = video.get_frame(t)
-            detections = self.model.detect(frame)
+        for index in indices:
+            t = index / reader.fps
             segments.append(
                 {
                     "start": t,
-                    "end": min(t + frame_sample_interval / video.fps, video.duration),
-                    "detections": detections,
+                    "end": min(t + frame_sample_interval / reader.fps, reader.duration),
+                    "detections": known[index],
                 }
             )
-        return segments
-
-    def _process_single_face(self, clip, box, new_height):
-        x1, y1, x2, y2 = box
-        face_center_x = (x1 + x2) / 2
-
-        crop_width = new_height * 9 / 16
-        crop_x1 = max(0, face_center_x - crop_width / 2)
-        crop_x2 = min(clip.w, crop_x1 + crop_width)
-
-        if crop_x2 - crop_x1 < crop_width:
-            crop_x1 = max(0, crop_x2 - crop_width)
-
-        cropped_clip = clip.crop(x1=crop_x1, width=crop_width).resize(height=new_height)
-
-        # Draw face box
-        face_box_clip = cropped_clip
-
-        return CompositeVideoClip(
-            [face_box_clip.set_position("center")], size=(clip.w, new_height)
-        )
 
+        if self.adaptive:
+            # Windows run until the next detection, so shot cuts stay frame-accurate
+            for segment, following in zip(segments, segments[1:]):
+                segment["end"] = following["start"]
+            if segments:
+                segments[-1]["end"] = min(reader.end_frame / reader.fps, reader.duration)
+        return segments
 
-    def _process_center_clip(self, clip, new_height):
-        # Calculate center crop area
-        crop_width = clip.w 
-        crop_x1 = (clip.w - crop_width) / 2
-        crop_x2 = crop_x1 + crop_width
-
-        cropped_clip = clip.crop(x1=crop_x1, width=crop_width).resize(height=new_height)
-        return CompositeVideoClip(
-            [cropped_clip.set_position("center")], size=(clip.w, new_height)
-        )
+    def _detect_frames(self, reader, known):
+        """
+        Decode the sampled frames once and run batched detection on those not in ``known``.
+
+        New detections are added to ``known``; returns the sampled frame indices.
+        """
+        sampled = self._adaptive_samples(reader) if self.adaptive else iter(reader)
+        box_scale = np.array(reader.scale * 2)
+        indices = []
+        batch_indices, batch_frames = [], []
+        detected = 0
+
+        def flush():
+            for index, detections in zip(
+                batch_indices, self.model.detect_batch(batch_frames)
+            ):
+                if reader.size != reader.source_size:
+                    # Map boxes found on the downscaled frame back to source pixels
+                    detections = [(box / box_scale, conf) for box, conf in detections]
+                known[index] = detections
+            batch_indices.clear()
+            batch_frames.clear()
+
+        total = reader.end_frame - reader.start_frame
+        with tqdm(total=total, desc="Generating segments") as progress:
+            last_index = reader.start_frame
+            for index, _, frame in sampled:
+                progress.update(index - last_index)
+                last_index = index
+                indices.append(index)
+                if index in known:
+                    continue
+                detected += 1
+                batch_indices.append(index)
+                batch_frames.append(frame)
+                if len(batch_frames) >= self.batch_size:
+                    flush()
+            if batch_frames:
+                flush()
+            progress.update(reader.end_frame - last_index)
+
+        print(f"Ran detection on {detected} of {total} frames")
+        return indices
+
+    def _adaptive_samples(self, reader):
+        """Yield the first frame of every shot plus one frame per fallback interval inside shots."""
+        self.scene_detector.reset()
+        last_sampled = None
+        for index, t, frame in reader:
+            cut = self.scene_detector.is_cut(frame)
+            if last_sampled is None or cut or index - last_sampled >= self.fallback_interval:
+                last_sampled = index
+                yield index, t, frame
 
     def _draw_face_box(self, get_frame, t, x1, y1, x2, y2):
         frame = get_frame(t).copy()
@@ -141,35 +352,48 @@ class VideoProcessor:
             os.remove(os.path.join(self.temp_dir, file))
         os.rmdir(self.temp_dir)
 
-    def _process_two_faces(self, clip, boxes, new_height):
-        boxes = sorted(boxes, key=lambda x: x[0])  # Sort by x-coordinate
-
-        half_height = new_height //2
-        crop_width = half_height * 9 / 16
-
-        clips = []
-        for i, (x1, y1, x2, y2) in enumerate(boxes[:2]):
-            face_center_x = (x1 + x2) / 2
-
-            crop_x1 = max(0, face_center_x - crop_width / 2)
-            crop_x2 = min(clip.w, crop_x1 + crop_width)
-
-            if crop_x2 - crop_x1 < crop_width:
-                crop_x1 = max(0, crop_x2 - crop_width)
-
-            cropped_clip = clip.crop(x1=crop_x1, width=crop_width).resize(
-                height=half_height
-            )
-
-            # Draw face box
-            face_box_clip = cropped_clip
-            clips.append(face_box_clip.set_position(("center", ["top", "bottom"][i])))
-
-        return CompositeVideoClip(clips, size=(clip.w, new_height))
-
-
-
 
+def shard_boundaries(keyframes, fps, total_frames, shards):
+    """
+    Split ``[0, total_frames)`` into up to ``shards`` ranges of similar length
+    whose boundaries sit on source keyframes.
+
+    :return: Sorted frame indices, starting with 0 and ending with ``total_frames``.
+    """
+    candidates = sorted({round(t * fps) for t in keyframes} - {0})
+    candidates = [k for k in candidates if k < total_frames]
+    boundaries = {0, total_frames}
+    if candidates:
+        for i in range(1, shards):
+            target = total_frames * i / shards
+            boundaries.add(min(candidates, key=lambda k: abs(k - target)))
+    return sorted(boundaries)
+
+
+_shard_processor = None
+
+
+def _init_shard_worker(model_config, options, workers):
+    global _shard_processor
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if model_config.get("threads") is None:
+        model_config["threads"] = threads
+    if options["renderer"].threads is None:
+        options["renderer"].threads = threads
+    _shard_processor = VideoProcessor(YOLOModel(**model_config), **options)
+
+
+def _render_shard(shard):
+    input_video, shard_file, frame_sample_interval, start_frame, end_frame = shard
+    _shard_processor.render_range(
+        input_video,
+        shard_file,
+        frame_sample_interval,
+        start_frame,
+        end_frame,
+        audio=False,
+    )
+    return shard_file
 
 
 # Main execution
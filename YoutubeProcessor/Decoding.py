@@ -0,0 +1,176 @@
+import json
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+
+
+def probe_video(path):
+    """Read the size, frame rate and duration of the first video stream with ffprobe."""
+    output = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=width,height,r_frame_rate,avg_frame_rate:format=duration",
+            "-of", "json",
+            path,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    info = json.loads(output)
+    stream = info["streams"][0]
+
+    rate = "0/1"
+    for key in ("r_frame_rate", "avg_frame_rate"):
+        if not stream.get(key, "0/0").endswith("/0"):
+            rate = stream[key]
+            break
+
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "rate": rate,
+        "fps": float(Fraction(rate)),
+        "duration": float(info["format"]["duration"]),
+    }
+
+
+def audio_codec(path):
+    """Codec name of the first audio stream, or None if the file has no audio."""
+    output = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "a:0",
+            "-show_entries", "stream=codec_name",
+            "-of", "csv=p=0",
+            path,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.strip()
+    return output or None
+
+
+def stream_signature(path):
+    """Video stream parameters that must match for a stream-copy concat."""
+    output = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=codec_name,profile,width,height,pix_fmt,r_frame_rate,time_base",
+            "-of", "json",
+            path,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output)["streams"][0]
+
+
+def keyframe_times(path):
+    """Presentation times of the video keyframes, read from packet flags without decoding."""
+    output = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags",
+            "-of", "csv=p=0",
+            path,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    times = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            times.append(float(pts_time))
+    return sorted(times)
+
+
+class FrameReader:
+    """
+    Forward-only frame reader backed by a single ffmpeg decode.
+
+    Frames are decoded once, in order, and only every ``sample_interval``-th
+    frame is converted and piped back, optionally downscaled to ``width``.
+    Iterating yields ``(frame_index, timestamp, frame)`` tuples where
+    ``frame`` is an RGB ``uint8`` array, like ``VideoFileClip.get_frame``.
+
+    ``start_frame``/``end_frame`` restrict decoding to a range of the clip;
+    frame indices and timestamps stay relative to the start of the file.
+    """
+
+    def __init__(self, path, sample_interval=1, width=None, start_frame=0, end_frame=None):
+        info = probe_video(path)
+        self.path = path
+        self.rate = info["rate"]
+        self.fps = info["fps"]
+        self.duration = info["duration"]
+        self.source_size = (info["width"], info["height"])
+        self.total_frames = int(self.fps * self.duration)
+        self.sample_interval = max(1, int(sample_interval))
+
+        self.start_frame = max(0, int(start_frame))
+        self.end_frame = self.total_frames if end_frame is None else min(end_frame, self.total_frames)
+        first = self.start_frame + (-self.start_frame % self.sample_interval)
+        self.indices = range(first, self.end_frame, self.sample_interval)
+
+        if width and width < info["width"]:
+            height = int(round(info["height"] * width / info["width"] / 2)) * 2
+            self.size = (int(width), max(2, height))
+        else:
+            self.size = self.source_size
+        self.scale = (
+            self.size[0] / self.source_size[0],
+            self.size[1] / self.source_size[1],
+        )
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _command(self):
+        filters = []
+        if self.sample_interval > 1:
+            filters.append(
+                f"select='not(mod(n+{self.start_frame}\\,{self.sample_interval}))'"
+            )
+        if self.size != self.source_size:
+            filters.append(f"scale={self.size[0]}:{self.size[1]}")
+
+        cmd = ["ffmpeg", "-loglevel", "error", "-nostdin"]
+        if self.start_frame:
+            # Accurate input seek: decoding starts at the previous keyframe and
+            # everything before half a frame ahead of start_frame is dropped
+            cmd += ["-ss", f"{(self.start_frame - 0.5) / self.fps:.6f}"]
+        cmd += ["-i", self.path, "-an", "-sn"]
+        if filters:
+            cmd += ["-vf", ",".join(filters)]
+        return cmd + [
+            "-vsync", "0", "-frames:v", str(len(self.indices)),
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+        ]
+
+    def __iter__(self):
+        width, height = self.size
+        frame_bytes = width * height * 3
+        process = subprocess.Popen(
+            self._command(), stdout=subprocess.PIPE, bufsize=frame_bytes
+        )
+        try:
+            for index in self.indices:
+                buffer = process.stdout.read(frame_bytes)
+                if len(buffer) < frame_bytes:
+                    break
+                frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+                yield index, index / self.fps, frame
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
@@ -0,0 +1,74 @@
+import fcntl
+import hashlib
+import os
+import pickle
+
+
+def content_hash(path, chunk_size=1 << 20):
+    """Hash the bytes of a file, so renamed or re-downloaded copies share cache entries."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """
+    On-disk cache of per-frame detections.
+
+    Entries live under ``<cache_dir>/<content hash>/`` in one pickle per
+    detector configuration (model name, confidence threshold, model input
+    size, decode width). Each entry holds:
+
+    - ``detections``: ``{frame_index: [(box, confidence), ...]}`` in source pixels
+    - ``samples``: ``{sampling signature: [frame_index, ...]}``, the frames a
+      given sampling mode and frame range decoded, so a re-run can skip the decode.
+    """
+
+    def __init__(self, cache_dir="detection_cache"):
+        self.cache_dir = cache_dir
+        self._hashes = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, input_video, detector, detect_width):
+        """
+        :param detector: ``YOLOModel.config()`` of the model producing the detections.
+        :param detect_width: Width frames are decoded at, or None for full size.
+        """
+        stat = os.stat(input_video)
+        file_id = (os.path.abspath(input_video), stat.st_size, stat.st_mtime_ns)
+        if file_id not in self._hashes:
+            self._hashes[file_id] = content_hash(input_video)
+
+        model = os.path.basename(str(detector["model_name"]))
+        config = (
+            f"{model}_conf{detector['conf_threshold']}"
+            f"_in{detector.get('input_size') or 'default'}_w{detect_width or 'full'}"
+        )
+        return os.path.join(self._hashes[file_id], config)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def load(self, key):
+        path = self._path(key)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        return {"detections": {}, "samples": {}}
+
+    def save(self, key, entry):
+        """Merge ``entry`` into the stored one; safe to call from concurrent workers."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stored = self.load(key)
+            stored["detections"].update(entry["detections"])
+            stored["samples"].update(entry["samples"])
+
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump(stored, f)
+            os.replace(temp_path, path)
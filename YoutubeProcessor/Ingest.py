@@ -0,0 +1,306 @@
+"""
+Bulk ingestion of many videos into the embeddings store.
+
+Transcripts are loaded on a thread pool, while a pool of warm embedding
+workers (each holding its own copy of the model) chunks and embeds them.
+Finished videos are written in the same layout ``Faiss.add_transcripts``
+produces. By default each video is embedded in its own batches, which gives
+the same vectors as ``Faiss.add_transcripts``; ``--masked-pooling`` batches
+chunks across videos instead, but those vectors only mix with other
+masked-pooling videos:
+
+    python Ingest.py VIDEO_ID [VIDEO_ID ...]
+    python Ingest.py --file ids.txt --workers 2 --library
+    python Ingest.py --file ids.txt --masked-pooling
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from Transcript import get_or_create_transcript
+from VectorDB import Faiss, LibraryIndex, chunk_text, has_video_data, write_video_data
+
+VIDEO_ID = re.compile(r"^[a-zA-Z0-9_-]{11}$")
+
+# Set in each embedding worker by _init_worker
+_worker_db = None
+
+
+def read_video_ids(values=(), path=None):
+    """Video ids from the command line and/or a file (one id or URL per line, # comments)."""
+    lines = list(values)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            lines.extend(line.split("#", 1)[0].strip() for line in f)
+
+    video_ids = []
+    for line in filter(None, lines):
+        if VIDEO_ID.match(line):
+            video_ids.append(line)
+            continue
+        from _utils import video_id_from_url
+
+        video_id = video_id_from_url(line)
+        if video_id:
+            video_ids.append(video_id)
+        else:
+            print(f"Skipping unrecognised video: {line}")
+    return list(dict.fromkeys(video_ids))
+
+
+def _init_worker(options):
+    global _worker_db
+    _worker_db = Faiss(**options)
+    # Load the model once per worker, before the first batch arrives
+    _worker_db.model
+
+
+def _embed_videos(videos):
+    """
+    Chunk and embed a group of videos in one pass, so embedding batches mix
+    chunks of several videos.
+
+    :param videos: ``[(video_id, transcripts), ...]``
+    :return: ``([(video_id, chunks, embeddings), ...], seconds)``
+    """
+    start = time.perf_counter()
+    chunked = [(video_id, transcripts, _worker_db._chunk_transcript(transcripts)) for video_id, transcripts in videos]
+    texts = [
+        [chunk_text(transcripts[chunk['first']:chunk['last']]) for chunk in chunks]
+        for _, transcripts, chunks in chunked
+    ]
+
+    if _worker_db.exact_padding:
+        # Padding to the longest text of a call changes vectors, so keep one call per video
+        embeddings = [_worker_db._create_embeddings(video_texts) for video_texts in texts]
+    else:
+        flat = _worker_db._create_embeddings([text for video_texts in texts for text in video_texts])
+        embeddings, offset = [], 0
+        for video_texts in texts:
+            embeddings.append(flat[offset:offset + len(video_texts)])
+            offset += len(video_texts)
+
+    results = [(video_id, chunks, vectors) for (video_id, _, chunks), vectors in zip(chunked, embeddings)]
+    return results, time.perf_counter() - start
+
+
+class Stage:
+    """Item count and busy time of one pipeline stage."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.seconds = 0.0
+
+    def add(self, items, seconds):
+        self.items += items
+        self.seconds += seconds
+
+    def report(self, wall_seconds):
+        return {
+            "items": self.items,
+            "unit": self.unit,
+            "busy_seconds": round(self.seconds, 2),
+            "per_busy_second": round(self.items / self.seconds, 2) if self.seconds else None,
+            "per_wall_second": round(self.items / wall_seconds, 2) if wall_seconds else None,
+        }
+
+
+class Ingestor:
+    """
+    Ingests many videos with parallel transcript loading and pooled embedding.
+
+    :param workers: Embedding processes; each gets ``cpu_count // workers`` torch threads.
+    :param io_threads: Threads loading or downloading transcripts.
+    :param group_chunks: Approximate number of chunks handed to a worker at once.
+    :param exact_padding: Embed each video on its own with exact padding, giving
+        the same vectors as ``Faiss.add_transcripts``. This default does not
+        batch chunks across videos. Turning it off batches chunks of several
+        videos and pools over real tokens only, which is faster; the mode is
+        recorded per video, and stores or library indexes built the default
+        way will re-embed or refuse such videos.
+    :param refresh: Re-fetch transcripts and re-embed videos that are already stored.
+    """
+
+    def __init__(self, model_name='Alibaba-NLP/gte-large-en-v1.5', workers=1, io_threads=8,
+                 batch_size=16, group_chunks=256, exact_padding=True, index_type='flat',
+                 refresh=False, library=None):
+        self.workers = workers
+        self.io_threads = io_threads
+        self.group_chunks = group_chunks
+        self.refresh = refresh
+        self.library = library
+        self.worker_options = {
+            "model_name": model_name,
+            "batch_size": batch_size,
+            "exact_padding": exact_padding,
+            "num_threads": max(1, (os.cpu_count() or 1) // workers),
+        }
+        # Only used for chunk sizes, index building and storage paths; never loads the model
+        self.db = Faiss(model_name=model_name, exact_padding=exact_padding, index_type=index_type)
+
+        self.stages = {
+            "transcripts": Stage("transcripts", "videos"),
+            "embedding": Stage("embedding", "chunks"),
+            "writing": Stage("writing", "videos"),
+        }
+
+    def _load_transcript(self, video_id):
+        start = time.perf_counter()
+        try:
+            transcripts, _ = get_or_create_transcript(video_id, refresh=self.refresh)
+            transcripts = json.loads(transcripts) if transcripts else None
+        except Exception as e:
+            print(f"Could not load the transcript of {video_id}: {e}")
+            transcripts = None
+        return video_id, transcripts, time.perf_counter() - start
+
+    def _estimated_chunks(self, transcripts):
+        duration = transcripts[-1]['start'] + transcripts[-1]['duration'] - transcripts[0]['start']
+        return max(1, duration / max(1, self.db.chunk_duration - self.db.overlap_duration))
+
+    def _write(self, video_id, chunks, transcripts, embeddings):
+        start = time.perf_counter()
+        folder = os.path.join(self.db.base_dir, video_id)
+        write_video_data(folder, chunks, transcripts, embeddings, self.db._build_index(embeddings),
+                         exact_padding=self.db.exact_padding)
+        if self.library is not None:
+            self.library.add_video(video_id, embeddings, chunks, first_chunk=0,
+                                   exact_padding=self.db.exact_padding)
+        self.stages["writing"].add(1, time.perf_counter() - start)
+
+    def run(self, video_ids):
+        """Ingest ``video_ids``; returns a report with per-stage throughput."""
+        wall_start = time.perf_counter()
+        video_ids = list(dict.fromkeys(video_ids))
+        pending = [
+            video_id for video_id in video_ids
+            if self.refresh or not has_video_data(os.path.join(self.db.base_dir, video_id))
+        ]
+        skipped, failed = len(video_ids) - len(pending), []
+        if self.library is not None and self.library.exact_padding not in (None, self.db.exact_padding):
+            # Checked up front, so no video is stored without reaching the library
+            raise ValueError(f"The library index uses exact_padding={self.library.exact_padding}, "
+                             f"these videos would use exact_padding={self.db.exact_padding}")
+        print(f"Ingesting {len(pending)} videos ({skipped} already stored)")
+
+        transcripts_by_id = {}
+        in_flight = []
+        context = multiprocessing.get_context("spawn")
+        try:
+            with context.Pool(self.workers, initializer=_init_worker, initargs=(self.worker_options,)) as pool, \
+                    ThreadPoolExecutor(self.io_threads) as io_pool:
+
+                def collect(block):
+                    # Write finished groups; with block=True wait until at most
+                    # 2 groups per worker are queued, so transcripts do not pile up
+                    while in_flight and (in_flight[0][0].ready() or (block and len(in_flight) > 2 * self.workers)):
+                        result, group_ids = in_flight.pop(0)
+                        try:
+                            results, seconds = result.get()
+                        except Exception as e:
+                            print(f"Embedding failed for {', '.join(group_ids)}: {e}")
+                            failed.extend(group_ids)
+                            for video_id in group_ids:
+                                transcripts_by_id.pop(video_id)
+                            continue
+                        self.stages["embedding"].add(sum(len(chunks) for _, chunks, _ in results), seconds)
+                        for video_id, chunks, embeddings in results:
+                            try:
+                                self._write(video_id, chunks, transcripts_by_id.pop(video_id), embeddings)
+                            except Exception as e:
+                                print(f"Writing {video_id} failed: {e}")
+                                failed.append(video_id)
+
+                def submit(group):
+                    in_flight.append((pool.apply_async(_embed_videos, (group,)), [video_id for video_id, _ in group]))
+
+                group, group_size = [], 0
+                futures = [io_pool.submit(self._load_transcript, video_id) for video_id in pending]
+                for future in as_completed(futures):
+                    video_id, transcripts, seconds = future.result()
+                    self.stages["transcripts"].add(1, seconds)
+                    if not transcripts:
+                        failed.append(video_id)
+                        continue
+
+                    transcripts_by_id[video_id] = transcripts
+                    group.append((video_id, transcripts))
+                    group_size += self._estimated_chunks(transcripts)
+                    if group_size >= self.group_chunks:
+                        submit(group)
+                        group, group_size = [], 0
+                    collect(block=True)
+
+                if group:
+                    submit(group)
+                while in_flight:
+                    in_flight[0][0].wait()
+                    collect(block=False)
+        finally:
+            # Videos written so far count as stored on the next run, so they must reach the library
+            if self.library is not None:
+                self.library.save()
+
+        wall_seconds = time.perf_counter() - wall_start
+        report = {
+            "videos": len(video_ids),
+            "ingested": len(pending) - len(failed),
+            "skipped": skipped,
+            "failed": failed,
+            "wall_seconds": round(wall_seconds, 2),
+            "stages": {name: stage.report(wall_seconds) for name, stage in self.stages.items()},
+        }
+        for name, stage in report["stages"].items():
+            print(f"{name}: {stage['items']} {stage['unit']}, "
+                  f"{stage['per_busy_second']}/s busy, {stage['per_wall_second']}/s wall")
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video_ids", nargs="*", help="Video ids or URLs")
+    parser.add_argument("--file", help="File with one video id or URL per line")
+    parser.add_argument("--model", default="Alibaba-NLP/gte-large-en-v1.5")
+    parser.add_argument("--workers", type=int, default=1, help="Embedding processes")
+    parser.add_argument("--io-threads", type=int, default=8, help="Transcript download threads")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--group-chunks", type=int, default=256, help="Chunks sent to a worker at once")
+    parser.add_argument("--masked-pooling", dest="exact_padding", action="store_false",
+                        help="Batch chunks across videos and pool over real tokens only (faster, "
+                             "but vectors differ from Faiss.add_transcripts). Without it, each video "
+                             "is embedded in its own batches and nothing is batched across videos")
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--refresh", action="store_true", help="Re-fetch and re-embed stored videos")
+    parser.add_argument("--library", action="store_true", help="Add the videos to the library-wide index")
+    parser.add_argument("--report", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+
+    video_ids = read_video_ids(args.video_ids, args.file)
+    if not video_ids:
+        parser.error("no video ids given")
+
+    ingestor = Ingestor(
+        model_name=args.model,
+        workers=args.workers,
+        io_threads=args.io_threads,
+        batch_size=args.batch_size,
+        group_chunks=args.group_chunks,
+        exact_padding=args.exact_padding,
+        index_type=args.index_type,
+        refresh=args.refresh,
+        library=LibraryIndex() if args.library else None,
+    )
+    report = ingestor.run(video_ids)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
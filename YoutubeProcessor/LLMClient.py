@@ -0,0 +1,295 @@
+import asyncio
+import itertools
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Seconds in a rate-limit reset header such as ``"2m59.56s"``, ``"7.66s"`` or ``"120ms"``."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_SECONDS[unit] for number, unit in parts)
+
+
+def retry_after(headers):
+    """Seconds the server asked us to wait (``retry-after``, in seconds or as a date), or None."""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class Priority:
+    """Priority of a queued request that can be raised while it waits, see ``AsyncLLMClient.prioritize``."""
+
+    def __init__(self, value=0):
+        self.value = value
+
+
+def _rank(waiter):
+    priority, arrival = waiter
+    return -getattr(priority, "value", priority), arrival
+
+
+class TokenBucket:
+    """
+    Token bucket holding ``capacity`` units that refill at ``rate`` per second.
+
+    ``update`` re-syncs it with the limit, remaining units and reset time the
+    API reports, so the local estimate never drifts far from the server's.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+        self._changed = None
+        # (priority, arrival) of waiting acquires; only the first by _rank may take units
+        self._waiters = []
+        self._arrivals = itertools.count()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1, priority=0):
+        """
+        Wait until ``amount`` units are available and take them. Higher
+        ``priority`` waiters are served first, equal ones in arrival order.
+
+        :param priority: A number, or a ``Priority`` that may be raised while waiting.
+        """
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        amount = min(amount, self.capacity)
+        waiter = (priority, next(self._arrivals))
+        async with self._changed:
+            self._waiters.append(waiter)
+            # A new first waiter may need fewer units than the one it overtook
+            self._changed.notify_all()
+            try:
+                while True:
+                    if min(self._waiters, key=_rank) is not waiter:
+                        await self._changed.wait()
+                        continue
+                    self._refill()
+                    if self.level >= amount:
+                        self.level -= amount
+                        return
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), (amount - self.level) / self.rate)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiters.remove(waiter)
+                self._changed.notify_all()
+
+    async def wake(self):
+        """Re-check the waiting order, after a waiter's ``Priority`` changed."""
+        if self._changed is not None:
+            async with self._changed:
+                self._changed.notify_all()
+
+    def consume(self, amount):
+        """Take (or, if negative, give back) units without waiting; the level may go negative."""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+    def update(self, limit, remaining, reset_seconds):
+        if limit is None or remaining is None:
+            return
+        self._refill()
+        self.capacity = limit
+        self.level = min(self.level, remaining)
+        if reset_seconds and remaining < limit:
+            # Rate at which the server refills the used part of the window
+            self.rate = (limit - remaining) / reset_seconds
+
+
+class AsyncLLMClient:
+    """
+    Asynchronous Groq chat client with bounded concurrency, token-bucket rate
+    limiting and exponential backoff.
+
+    Requests and tokens each have a bucket that starts from
+    ``requests_per_minute`` / ``tokens_per_minute`` and is re-synced from the
+    ``x-ratelimit-*`` headers of every response. Rate-limit, server and
+    connection errors are retried after the server's ``retry-after`` when it
+    sends one, else after a jittered exponential delay.
+
+    Calls run on one background event loop, so synchronous code can use
+    ``generate`` and ``submit`` from any thread; async code can await
+    ``complete`` and ``complete_many`` directly from a single loop.
+
+    :param base_url: API root, e.g. a local mock server for tests.
+    """
+
+    def __init__(self, api_key='', model="llama-3.1-70b-versatile", base_url=None, max_concurrency=8,
+                 requests_per_minute=30, tokens_per_minute=6000, max_retries=6, base_delay=1.0,
+                 max_delay=60.0, timeout=120.0):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+
+        self._client = None
+        self._semaphore = None
+        # Monotonic time before which nothing is sent, after a 429
+        self._resume_at = 0.0
+        self._loop = None
+        self._thread = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from groq import AsyncGroq
+
+            # Retries are handled here, so the SDK's own are disabled
+            self._client = AsyncGroq(api_key=self.api_key, base_url=self.base_url,
+                                     max_retries=0, timeout=self.timeout)
+        return self._client
+
+    def _update_limits(self, headers):
+        def number(name):
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        self.requests.update(number("x-ratelimit-limit-requests"), number("x-ratelimit-remaining-requests"),
+                             parse_duration(headers.get("x-ratelimit-reset-requests")))
+        self.tokens.update(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"),
+                           parse_duration(headers.get("x-ratelimit-reset-tokens")))
+
+    def _backoff(self, attempt, headers):
+        delay = retry_after(headers)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        return delay
+
+    async def complete(self, prompt, model=None, temperature=0.7, max_tokens=None, priority=0):
+        """
+        Send one user prompt and return the stripped reply text.
+
+        :param priority: Requests with a higher priority get rate-limit capacity
+            first; pass a ``Priority`` to be able to raise it later.
+        """
+        import groq
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Rough prompt size (~4 characters per token) plus room for the reply;
+        # corrected with the reported usage once the reply arrives
+        estimate = len(prompt) // 4 + (max_tokens or 512)
+        options = {"max_tokens": max_tokens} if max_tokens else {}
+
+        for attempt in range(self.max_retries + 1):
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.requests.acquire(1, priority)
+            await self.tokens.acquire(estimate, priority)
+            async with self._semaphore:
+                try:
+                    raw = await self.client.chat.completions.with_raw_response.create(
+                        model=model or self.model,
+                        temperature=temperature,
+                        messages=[{"role": "user", "content": prompt}],
+                        **options,
+                    )
+                except (groq.RateLimitError, groq.InternalServerError,
+                        groq.APIConnectionError, groq.APITimeoutError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    headers = getattr(getattr(e, "response", None), "headers", None)
+                    delay = self._backoff(attempt, headers)
+                    if isinstance(e, groq.RateLimitError):
+                        # Hold back every request, not just this one
+                        self._update_limits(headers or {})
+                        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                    print(f"LLM request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+
+            self._update_limits(raw.headers)
+            response = await raw.parse()
+            if response.usage is not None:
+                self.tokens.consume(response.usage.total_tokens - estimate)
+            return response.choices[0].message.content.strip()
+
+    async def complete_many(self, prompts, return_exceptions=False, **options):
+        """Replies to ``prompts`` in order, sent concurrently within the limits."""
+        return await asyncio.gather(
+            *(self.complete(prompt, **options) for prompt in prompts),
+            return_exceptions=return_exceptions,
+        )
+
+    def _event_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+            self._thread.start()
+        return self._loop
+
+    def submit(self, coroutine):
+        """Run a coroutine on the client's event loop; returns a ``concurrent.futures.Future``."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._event_loop())
+
+    def prioritize(self, priority, value=1):
+        """Raise a queued request's ``Priority`` from any thread, instead of sending it again."""
+        priority.value = value
+        if self._loop is not None:
+            self.submit(self.requests.wake())
+            self.submit(self.tokens.wake())
+
+    def generate(self, prompt, priority=1, **options):
+        """Blocking ``complete`` for synchronous callers; by default ahead of background requests."""
+        return self.submit(self.complete(prompt, priority=priority, **options)).result()
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._client is not None:
+            self.submit(self._client.close()).result()
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = self._thread = self._semaphore = None
+        self.requests._changed = self.tokens._changed = None
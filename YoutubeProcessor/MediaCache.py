@@ -0,0 +1,84 @@
+import os
+import shutil
+from collections import Counter
+
+
+class MediaCache:
+    """
+    Size-bounded local cache of downloaded source videos.
+
+    Files are stored as ``<cache_dir>/<video_id>/<format_id>.<ext>``. Every hit
+    refreshes the file's modification time, and when the cache grows past
+    ``max_bytes`` the least recently used files are evicted first.
+    """
+
+    def __init__(self, cache_dir="media_cache", max_bytes=20 * 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Clip requests per source seen by this instance, cached or not
+        self._requests = Counter()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, video_id, format_id, ext="mp4"):
+        return os.path.join(self.cache_dir, video_id, f"{format_id}.{ext}")
+
+    def _touch(self, path):
+        os.utime(path)
+        return path
+
+    def get(self, video_id, format_id, ext="mp4"):
+        """Path of the cached file for this video and format, or None."""
+        path = self.path(video_id, format_id, ext)
+        if os.path.isfile(path):
+            return self._touch(path)
+        return None
+
+    def requested(self, video_id):
+        """Record a clip request for this video; returns how many were made so far."""
+        self._requests[video_id] += 1
+        return self._requests[video_id]
+
+    def find(self, video_id):
+        """Most recently used cached file of any format for this video, or None."""
+        folder = os.path.join(self.cache_dir, video_id)
+        if not os.path.isdir(folder):
+            return None
+        files = [
+            os.path.join(folder, name)
+            for name in os.listdir(folder)
+            if not name.endswith(".part")
+        ]
+        if not files:
+            return None
+        return self._touch(max(files, key=os.path.getmtime))
+
+    def put(self, video_id, format_id, source_path, ext="mp4"):
+        """Move a downloaded file into the cache and evict old entries if needed."""
+        path = self.path(video_id, format_id, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.abspath(source_path) != os.path.abspath(path):
+            shutil.move(source_path, path)
+        self._touch(path)
+        self.evict(keep=path)
+        return path
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+                continue
+            os.remove(path)
+            total -= size
+            folder = os.path.dirname(path)
+            if folder != self.cache_dir and not os.listdir(folder):
+                os.rmdir(folder)
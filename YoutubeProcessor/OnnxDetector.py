@@ -0,0 +1,122 @@
+import cv2
+import numpy as np
+
+
+def export_onnx(weights="yolov5nu.pt", imgsz=640, int8=False):
+    """
+    Export ultralytics weights to ONNX with a dynamic batch axis, optionally
+    followed by dynamic int8 quantization.
+
+    :return: Path of the ``.onnx`` file to pass to ``YOLOModel(model_name=...)``.
+    """
+    from ultralytics import YOLO
+
+    path = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True)
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized = path.replace(".onnx", ".int8.onnx")
+        quantize_dynamic(path, quantized, weight_type=QuantType.QUInt8)
+        path = quantized
+    return path
+
+
+class OnnxYOLO:
+    """
+    CPU inference for YOLO models exported to ONNX (float or int8-quantized).
+
+    Pre- and post-processing follow the ultralytics predictor: letterbox to
+    ``imgsz``, channel flip, per-class NMS. ``threads`` sets onnxruntime's
+    intra-op thread pool, so several detectors can share a node without
+    oversubscribing cores.
+    """
+
+    def __init__(self, path, imgsz=640, threads=None, conf=0.25, iou=0.7, max_det=300):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("onnxruntime is required to load .onnx models") from e
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        height, width = model_input.shape[2:]
+        self.imgsz = (
+            (height, width) if isinstance(height, int) and isinstance(width, int) else (imgsz, imgsz)
+        )
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+    def _letterbox(self, frame):
+        height, width = frame.shape[:2]
+        target_h, target_w = self.imgsz
+        ratio = min(target_h / height, target_w / width)
+        new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+        pad_x, pad_y = (target_w - new_w) / 2, (target_h - new_h) / 2
+
+        resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+        bottom, right = target_h - new_h - top, target_w - new_w - left
+        padded = cv2.copyMakeBorder(
+            resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114)
+        )
+        return padded, ratio, (left, top)
+
+    def _postprocess(self, prediction, ratio, pad, frame_shape):
+        prediction = prediction.T  # (anchors, 4 + classes)
+        scores = prediction[:, 4:]
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        keep = confidences > self.conf
+        prediction, classes, confidences = prediction[keep], classes[keep], confidences[keep]
+        if not len(prediction):
+            return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+        cx, cy, w, h = prediction[:, 0], prediction[:, 1], prediction[:, 2], prediction[:, 3]
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+        # Offset boxes by class so a single NMS call never suppresses across classes
+        offset = classes[:, None] * 7680.0
+        shifted = boxes + offset
+        kept = cv2.dnn.NMSBoxes(
+            [[x1, y1, x2 - x1, y2 - y1] for x1, y1, x2, y2 in shifted.tolist()],
+            confidences.tolist(),
+            self.conf,
+            self.iou,
+        )
+        kept = np.array(kept, dtype=int).reshape(-1)[: self.max_det]
+        boxes, confidences = boxes[kept], confidences[kept]
+
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / ratio).clip(0, frame_shape[1])
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / ratio).clip(0, frame_shape[0])
+        return boxes.astype(np.float32), confidences.astype(np.float32)
+
+    def __call__(self, frames):
+        """
+        :return: One ``(boxes, confidences)`` pair per frame, boxes as ``xyxy``
+            in the frame's own pixel coordinates.
+        """
+        prepared = [self._letterbox(frame) for frame in frames]
+        # Same channel handling as the ultralytics predictor for numpy input
+        blob = np.stack([image[..., ::-1] for image, _, _ in prepared])
+        blob = np.ascontiguousarray(blob.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            outputs = np.concatenate(
+                [self.session.run(None, {self.input_name: blob[i:i + 1]})[0] for i in range(len(blob))]
+            )
+
+        return [
+            self._postprocess(prediction, ratio, pad, frame.shape)
+            for prediction, (_, ratio, pad), frame in zip(outputs, prepared, frames)
+        ]
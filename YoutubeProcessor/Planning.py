@@ -0,0 +1,80 @@
+import numpy as np
+
+from Rendering import canvas_size, describe_layout, layout_placements
+
+
+class LayoutPlanner:
+    """
+    Turn per-window detections into a render plan.
+
+    Face centers are median-smoothed over time within runs of the same layout,
+    then consecutive windows whose layout matches and whose crops land within
+    ``tolerance`` pixels of each other are merged into a single plan entry.
+    """
+
+    def __init__(self, smoothing_window=5, tolerance=8):
+        self.smoothing_window = max(1, int(smoothing_window))
+        self.tolerance = tolerance
+
+    def plan(self, segments, frame_width):
+        """
+        :param segments: Output of ``VideoProcessor.segment_video``.
+        :param frame_width: Width of the source video in pixels.
+        :return: Time-ordered list of ``start``/``end``/``layout``/``centers`` entries.
+        """
+        windows = []
+        for segment in segments:
+            layout, centers = describe_layout(segment["detections"])
+            windows.append(
+                {
+                    "start": segment["start"],
+                    "end": segment["end"],
+                    "layout": layout,
+                    "centers": centers,
+                }
+            )
+
+        self._smooth(windows)
+        return self._merge(windows, frame_width)
+
+    def _smooth(self, windows):
+        half = self.smoothing_window // 2
+        run_start = 0
+        for i in range(1, len(windows) + 1):
+            if i < len(windows) and windows[i]["layout"] == windows[run_start]["layout"]:
+                continue
+
+            run = windows[run_start:i]
+            centers = np.array([window["centers"] for window in run], dtype=float)
+            if half and centers.size:
+                padded = np.pad(centers, ((half, half), (0, 0)), mode="edge")
+                stacked = np.stack([padded[j:j + len(run)] for j in range(2 * half + 1)])
+                smoothed = np.median(stacked, axis=0)
+                for window, row in zip(run, smoothed):
+                    window["centers"] = row.tolist()
+            run_start = i
+
+    def _crops(self, window, frame_width):
+        _, canvas_height = canvas_size(frame_width)
+        return [
+            placement[0]
+            for placement in layout_placements(
+                window["layout"], window["centers"], frame_width, canvas_height
+            )
+        ]
+
+    def _merge(self, windows, frame_width):
+        plan = []
+        anchor_crops = None
+        for window in windows:
+            crops = self._crops(window, frame_width)
+            if (
+                plan
+                and plan[-1]["layout"] == window["layout"]
+                and all(abs(a - b) <= self.tolerance for a, b in zip(anchor_crops, crops))
+            ):
+                plan[-1]["end"] = window["end"]
+                continue
+            plan.append(dict(window))
+            anchor_crops = crops
+        return plan
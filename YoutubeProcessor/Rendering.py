@@ -0,0 +1,241 @@
+import os
+import subprocess
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from Decoding import FrameReader, audio_codec, stream_signature
+
+
+TARGET_RATIO = 9 / 16
+
+# Audio codecs the mp4 muxer accepts as-is, so they can be stream-copied
+MP4_AUDIO_CODECS = {"aac", "mp3", "alac", "ac3", "eac3", "opus", "flac"}
+
+
+def canvas_size(frame_width):
+    """Size of the 9:16 output canvas for a source of the given width."""
+    return frame_width, int(frame_width / TARGET_RATIO)
+
+
+def describe_layout(detections):
+    """
+    Pick the layout for a window of detections.
+
+    :return: ``(layout, centers)`` where ``layout`` is ``"single"``, ``"two"``
+        or ``"center"`` and ``centers`` are the horizontal face centers it tracks.
+    """
+    if len(detections) == 1:
+        x1, _, x2, _ = detections[0][0]
+        return "single", [float(x1 + x2) / 2]
+    if len(detections) >= 2:
+        boxes = sorted((d[0] for d in detections[:2]), key=lambda box: box[0])
+        return "two", [float(x1 + x2) / 2 for x1, _, x2, _ in boxes]
+    return "center", []
+
+
+def crop_left(center_x, crop_width, frame_width):
+    """Left edge of a ``crop_width`` window centered on ``center_x``, kept inside the frame."""
+    crop_x1 = max(0, center_x - crop_width / 2)
+    crop_x2 = min(frame_width, crop_x1 + crop_width)
+    if crop_x2 - crop_x1 < crop_width:
+        crop_x1 = max(0, crop_x2 - crop_width)
+    return crop_x1
+
+
+def layout_placements(layout, centers, frame_width, canvas_height):
+    """
+    Turn a layout into crop/scale/stack operations.
+
+    :return: A list of ``(crop_x1, crop_width, target_height, position)`` where
+        ``position`` is the ``(x, y)`` anchor of the scaled crop on the canvas.
+    """
+    if layout == "single":
+        crop_width = canvas_height * 9 / 16
+        crop_x1 = crop_left(centers[0], crop_width, frame_width)
+        return [(crop_x1, crop_width, canvas_height, ("center", "center"))]
+    if layout == "two":
+        half_height = canvas_height // 2
+        crop_width = half_height * 9 / 16
+        return [
+            (crop_left(center, crop_width, frame_width), crop_width, half_height, ("center", anchor))
+            for center, anchor in zip(centers[:2], ["top", "bottom"])
+        ]
+    return [(0, frame_width, canvas_height, ("center", "center"))]
+
+
+class _Placement:
+    """One crop of the source frame, scaled and pasted at a fixed spot on the canvas."""
+
+    def __init__(self, crop_x1, crop_width, target_height, position, frame_size, canvas):
+        frame_width, frame_height = frame_size
+        canvas_width, canvas_height = canvas
+
+        self.x1 = int(crop_x1)
+        self.x2 = min(frame_width, int(crop_x1 + crop_width))
+        crop_w = self.x2 - self.x1
+        scaled_w = int(crop_w * target_height / frame_height)
+        scaled_h = int(target_height)
+        self.enlarge = scaled_w > crop_w or scaled_h > frame_height
+        self.scaled_size = (scaled_w, scaled_h)
+
+        anchors_x = {"left": 0, "center": (canvas_width - scaled_w) / 2, "right": canvas_width - scaled_w}
+        anchors_y = {"top": 0, "center": (canvas_height - scaled_h) / 2, "bottom": canvas_height - scaled_h}
+        self.left = int(anchors_x[position[0]])
+        self.top = int(anchors_y[position[1]])
+
+        # Visible part of the scaled crop, in canvas coordinates
+        self.dst_x1 = max(0, self.left)
+        self.dst_y1 = max(0, self.top)
+        self.dst_x2 = min(canvas_width, self.left + scaled_w)
+        self.dst_y2 = min(canvas_height, self.top + scaled_h)
+
+        # Same sample grid as cv2.resize, shifted so only visible pixels are computed
+        sx, sy = scaled_w / crop_w, scaled_h / frame_height
+        self.matrix = np.float32([
+            [sx, 0, 0.5 * sx - 0.5 + self.left - self.dst_x1],
+            [0, sy, 0.5 * sy - 0.5 + self.top - self.dst_y1],
+        ])
+
+    def paste(self, frame, canvas):
+        if self.dst_x2 <= self.dst_x1 or self.dst_y2 <= self.dst_y1:
+            return
+        crop = frame[:, self.x1:self.x2]
+        target = canvas[self.dst_y1:self.dst_y2, self.dst_x1:self.dst_x2]
+        if self.enlarge:
+            target[:] = cv2.warpAffine(
+                crop,
+                self.matrix,
+                (self.dst_x2 - self.dst_x1, self.dst_y2 - self.dst_y1),
+                flags=cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_REPLICATE,
+            )
+        else:
+            scaled = cv2.resize(crop, self.scaled_size, interpolation=cv2.INTER_AREA)
+            target[:] = scaled[
+                self.dst_y1 - self.top:self.dst_y2 - self.top,
+                self.dst_x1 - self.left:self.dst_x2 - self.left,
+            ]
+
+
+class FFmpegRenderer:
+    """
+    Single-pass 9:16 renderer.
+
+    Source frames are decoded once, composed on the canvas with the crop/scale/stack
+    operations of their plan entry, and streamed as raw video into one ffmpeg
+    encoder process which also muxes the source audio. With ``audio_codec="copy"``
+    the source audio packets are passed through untouched, unless the output
+    container cannot hold them, in which case they are encoded to AAC.
+    """
+
+    def __init__(self, codec="libx264", preset="medium", audio_codec="copy", threads=None):
+        self.codec = codec
+        self.preset = preset
+        self.audio_codec = audio_codec
+        self.threads = threads
+
+    def _encoder_command(self, input_video, output_video, canvas, rate, audio):
+        width, height = canvas
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", f"{width}x{height}", "-r", rate,
+            "-i", "pipe:0",
+        ]
+        if audio:
+            cmd += ["-i", input_video, "-map", "0:v:0", "-map", "1:a:0?"]
+        cmd += ["-c:v", self.codec, "-preset", self.preset]
+        if self.threads:
+            cmd += ["-threads", str(self.threads)]
+        if width % 2 == 0 and height % 2 == 0:
+            cmd += ["-pix_fmt", "yuv420p"]
+        if audio:
+            cmd += self._audio_options(input_video, output_video)
+        else:
+            cmd += ["-an"]
+        return cmd + [output_video]
+
+    def _audio_options(self, input_video, output_video):
+        codec = self.audio_codec
+        if codec == "copy" and output_video.lower().endswith((".mp4", ".m4v", ".mov")):
+            source_codec = audio_codec(input_video)
+            if source_codec is not None and source_codec not in MP4_AUDIO_CODECS:
+                codec = "aac"
+        return ["-c:a", codec, "-shortest"]
+
+    def render(self, input_video, output_video, plan, start_frame=0, end_frame=None, audio=True):
+        """
+        Render ``plan`` (a time-ordered list of ``start``/``end``/``layout``/``centers``
+        entries covering the clip) from ``input_video`` into ``output_video``.
+
+        ``start_frame``/``end_frame`` render only part of the clip; with
+        ``audio=False`` the output is video-only, for shards joined by ``concat``.
+        """
+        reader = FrameReader(input_video, start_frame=start_frame, end_frame=end_frame)
+        if not plan:
+            plan = [{"start": 0, "end": reader.duration, "layout": "center", "centers": []}]
+        frame_size = reader.source_size
+        canvas = canvas_size(frame_size[0])
+        placements = [
+            [
+                _Placement(*placement, frame_size, canvas)
+                for placement in layout_placements(
+                    entry["layout"], entry["centers"], frame_size[0], canvas[1]
+                )
+            ]
+            for entry in plan
+        ]
+
+        encoder = subprocess.Popen(
+            self._encoder_command(input_video, output_video, canvas, reader.rate, audio),
+            stdin=subprocess.PIPE,
+        )
+        frame_out = np.zeros((canvas[1], canvas[0], 3), dtype=np.uint8)
+        current = 0
+        try:
+            for _, t, frame in tqdm(reader, total=len(reader), desc="Rendering video"):
+                while current + 1 < len(plan) and t >= plan[current + 1]["start"]:
+                    current += 1
+                frame_out.fill(0)
+                for placement in placements[current]:
+                    placement.paste(frame, frame_out)
+                encoder.stdin.write(frame_out.data)
+        finally:
+            encoder.stdin.close()
+            returncode = encoder.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, encoder.args)
+
+    def concat(self, shard_files, input_video, output_video):
+        """
+        Join video-only shards rendered with identical encoder settings by
+        stream copy, adding the audio of ``input_video``.
+        """
+        signatures = [stream_signature(shard) for shard in shard_files]
+        for shard, signature in zip(shard_files[1:], signatures[1:]):
+            if signature != signatures[0]:
+                raise ValueError(
+                    f"Cannot stream-copy concat {shard}: {signature} != {signatures[0]}"
+                )
+
+        list_file = output_video + ".concat.txt"
+        with open(list_file, "w") as f:
+            for shard in shard_files:
+                escaped = os.path.abspath(shard).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        try:
+            subprocess.run(
+                [
+                    "ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "concat", "-safe", "0", "-i", list_file,
+                    "-i", input_video,
+                    "-map", "0:v:0", "-map", "1:a:0?",
+                    "-c:v", "copy", *self._audio_options(input_video, output_video),
+                    output_video,
+                ],
+                check=True,
+            )
+        finally:
+            os.remove(list_file)
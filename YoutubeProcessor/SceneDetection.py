@@ -0,0 +1,35 @@
+import cv2
+
+
+class SceneCutDetector:
+    """
+    Cheap shot-boundary detector working on small grayscale thumbnails.
+
+    Each frame is shrunk to ``thumb_size`` and compared with the previous one
+    by histogram distance (Bhattacharyya, 0 = identical, 1 = disjoint).
+    A distance above ``threshold`` marks the frame as the first of a new shot.
+    """
+
+    def __init__(self, threshold=0.35, thumb_size=(64, 36), bins=32):
+        self.threshold = threshold
+        self.thumb_size = thumb_size
+        self.bins = bins
+        self._previous = None
+
+    def reset(self):
+        self._previous = None
+
+    def _histogram(self, frame):
+        thumb = cv2.resize(frame, self.thumb_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(thumb, cv2.COLOR_RGB2GRAY)
+        hist = cv2.calcHist([gray], [0], None, [self.bins], [0, 256])
+        return cv2.normalize(hist, hist).flatten()
+
+    def is_cut(self, frame):
+        """Feed the next frame in decode order; return True if it starts a new shot."""
+        hist = self._histogram(frame)
+        previous, self._previous = self._previous, hist
+        if previous is None:
+            return False
+        distance = cv2.compareHist(previous, hist, cv2.HISTCMP_BHATTACHARYYA)
+        return distance > self.threshold
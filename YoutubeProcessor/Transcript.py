@@ -3,7 +3,7 @@ import os
 import sys
 from youtube_transcript_api import YouTubeTranscriptApi
 
-def get_or_create_transcript(video_id):
+def get_or_create_transcript(video_id, refresh=False):
     # Get the directory of the current script
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
@@ -17,8 +17,9 @@ def get_or_create_transcript(video_id):
     json_filename = os.path.join(video_folder, f"{video_id}_transcript.json")
     text_filename = os.path.join(video_folder, f"{video_id}_transcript.txt")
     
-    # Check if the folder already exists
-    if os.path.exists(video_folder):
+    # Check if the transcript files already exist (refresh re-fetches transcripts that may have grown).
+    # A failed fetch leaves an empty folder behind, so the folder alone is not enough
+    if os.path.exists(json_filename) and os.path.exists(text_filename) and not refresh:
         print(f"Transcript for video ID {video_id} already exists. Loading from files...")
         with open(json_filename, 'r', encoding='utf-8') as json_file:
             json_str = json_file.read()
@@ -28,7 +29,7 @@ def get_or_create_transcript(video_id):
     
     try:
         # Create the folder for the new video
-        os.makedirs(video_folder)
+        os.makedirs(video_folder, exist_ok=True)
         
         transcript = YouTubeTranscriptApi.get_transcript(video_id)
         
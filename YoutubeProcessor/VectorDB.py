@@ -1,171 +1,1037 @@
 import numpy as np
 import os
 import pickle
-from transformers import AutoTokenizer, AutoModel
-import torch, copy
+import resource
+import time
+import copy
+import json
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
 from Transcript import get_or_create_transcript
 import faiss
 
+# Folder inside the embeddings directory that holds the library-wide index
+LIBRARY_DIR = '_library'
+
+
+# Bumped whenever the per-video on-disk layout changes
+STORAGE_VERSION = 1
+
+# Faiss factory strings of the compressed index types, with the size of one
+# 1024-d gte-large vector (4096 bytes as float32). 'flat' searches embeddings.f32.
+INDEX_TYPES = {
+    'flat': None,
+    'sq16': 'SQfp16',  # 2048 bytes
+    'sq8': 'SQ8',  # 1024 bytes
+    'ivfpq': 'IVF{nlist},PQ{m}x{nbits}',  # m bytes, 256 by default
+}
+
+
+def _write_strings(folder, name, strings):
+    """Store strings as one UTF-8 blob plus an int64 array of byte offsets."""
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded])
+    with open(os.path.join(folder, f'{name}.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+    np.save(os.path.join(folder, f'{name}_offsets.npy'), offsets)
+
+
+def _read_strings(folder, name):
+    with open(os.path.join(folder, f'{name}.bin'), 'rb') as f:
+        blob = f.read()
+    offsets = np.load(os.path.join(folder, f'{name}_offsets.npy')).tolist()
+    return [blob[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def chunk_text(entries):
+    """Text of a chunk covering ``entries``; every caption is followed by a space."""
+    return ' '.join(entry['text'] for entry in entries) + ' ' if entries else ''
+
+
+def write_video_data(folder, metadata, entries, embeddings, index=None, rows_from=0, exact_padding=True):
+    """
+    Persist one video's chunks in the columnar layout read by ``read_video_data``.
+    With ``rows_from``, ``embeddings`` holds only the rows from that chunk on,
+    which overwrite the stored file from there while earlier rows stay on disk.
+
+    - ``embeddings.f32``: raw ``(count, dim)`` float32 matrix, memory-mappable
+    - ``starts/ends/durations.npy``: one row per chunk
+    - ``entries_*``: the transcript entries; chunk ``i`` covers entries
+      ``chunk_entries[i, 0]:chunk_entries[i, 1]``
+    - ``index.faiss``: the serialized index, for index types other than flat
+    - ``manifest.json``: written last, so a folder without it is incomplete;
+      records whether the vectors were pooled with ``exact_padding``
+    """
+    os.makedirs(folder, exist_ok=True)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    embeddings_path = os.path.join(folder, 'embeddings.f32')
+    with open(embeddings_path, 'r+b' if rows_from and os.path.exists(embeddings_path) else 'wb') as f:
+        f.seek(rows_from * embeddings.shape[1] * embeddings.itemsize)
+        f.write(embeddings.tobytes())
+        f.truncate()
+
+    np.save(os.path.join(folder, 'starts.npy'), np.array([c['start'] for c in metadata], dtype=np.float64))
+    np.save(os.path.join(folder, 'ends.npy'), np.array([c['end'] for c in metadata], dtype=np.float64))
+    np.save(os.path.join(folder, 'durations.npy'), np.array([c['duration'] for c in metadata], dtype=np.float64))
+    np.save(os.path.join(folder, 'chunk_entries.npy'),
+            np.array([(c['first'], c['last']) for c in metadata], dtype=np.int64).reshape(-1, 2))
+
+    np.save(os.path.join(folder, 'entries_start.npy'), np.array([e['start'] for e in entries], dtype=np.float64))
+    np.save(os.path.join(folder, 'entries_duration.npy'), np.array([e['duration'] for e in entries], dtype=np.float64))
+    _write_strings(folder, 'entries_text', [e['text'] for e in entries])
+
+    index_path = os.path.join(folder, 'index.faiss')
+    if isinstance(index, RerankIndex):
+        faiss.write_index(index.index, index_path)
+    elif os.path.exists(index_path):
+        os.remove(index_path)
+
+    manifest = {
+        'version': STORAGE_VERSION,
+        'count': rows_from + len(embeddings),
+        'dim': int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        'index_type': getattr(index, 'index_type', 'flat'),
+        'exact_padding': exact_padding,
+    }
+    temp_path = os.path.join(folder, 'manifest.json.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, os.path.join(folder, 'manifest.json'))
+
+
+def _compact_chunks(chunks):
+    """Turn chunks holding their own ``original_transcripts`` into entry offsets."""
+    entries, positions, metadata = [], {}, []
+    for chunk_id, chunk in enumerate(chunks):
+        first = None
+        for entry in chunk['original_transcripts']:
+            key = (entry['start'], entry['duration'], entry['text'])
+            if key not in positions:
+                positions[key] = len(entries)
+                entries.append(entry)
+            if first is None:
+                first = positions[key]
+        first = len(entries) if first is None else first
+        end = chunk['end']
+        if end is None and chunk['original_transcripts']:
+            # The old chunker left end unset on a trailing chunk made only of overlap
+            last_entry = chunk['original_transcripts'][-1]
+            end = last_entry['start'] + last_entry['duration']
+        metadata.append({
+            'id': chunk_id,
+            'start': chunk['start'],
+            'end': end,
+            'duration': chunk['duration'],
+            'first': first,
+            'last': first + len(chunk['original_transcripts']),
+        })
+    return metadata, entries
+
+
+def _migrate_legacy(folder):
+    """Rewrite a folder saved as metadata.pkl/embeddings.pkl in the columnar layout."""
+    with open(os.path.join(folder, 'metadata.pkl'), 'rb') as f:
+        metadata, entries = _compact_chunks(pickle.load(f))
+    with open(os.path.join(folder, 'embeddings.pkl'), 'rb') as f:
+        embeddings = pickle.load(f)
+    write_video_data(folder, metadata, entries, embeddings)
+    os.remove(os.path.join(folder, 'metadata.pkl'))
+    os.remove(os.path.join(folder, 'embeddings.pkl'))
+
+
+def has_video_data(folder):
+    return (os.path.exists(os.path.join(folder, 'manifest.json'))
+            or os.path.exists(os.path.join(folder, 'metadata.pkl')))
+
+
+def read_manifest(folder):
+    if not os.path.exists(os.path.join(folder, 'manifest.json')):
+        _migrate_legacy(folder)
+    with open(os.path.join(folder, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def read_embeddings(folder, manifest=None):
+    """Read-only memory map of one video's ``(count, dim)`` embeddings matrix."""
+    manifest = manifest or read_manifest(folder)
+    if manifest['count'] == 0:
+        return np.zeros((0, manifest['dim']), dtype=np.float32)
+    return np.memmap(os.path.join(folder, 'embeddings.f32'), dtype=np.float32, mode='r',
+                     shape=(manifest['count'], manifest['dim']))
+
+
+def read_video_data(folder):
+    """
+    Load one video's chunks.
+
+    :return: ``(metadata, entries, embeddings)``: compact chunk dicts, the
+        shared transcript entries they point into, and the memory-mapped
+        embeddings matrix.
+    """
+    manifest = read_manifest(folder)
+
+    entries = [
+        {'text': text, 'start': start, 'duration': duration}
+        for text, start, duration in zip(
+            _read_strings(folder, 'entries_text'),
+            np.load(os.path.join(folder, 'entries_start.npy')).tolist(),
+            np.load(os.path.join(folder, 'entries_duration.npy')).tolist(),
+        )
+    ]
+
+    columns = zip(
+        np.load(os.path.join(folder, 'starts.npy')).tolist(),
+        np.load(os.path.join(folder, 'ends.npy')).tolist(),
+        np.load(os.path.join(folder, 'durations.npy')).tolist(),
+        np.load(os.path.join(folder, 'chunk_entries.npy')).tolist(),
+    )
+    metadata = [
+        {'id': chunk_id, 'start': start, 'end': end, 'duration': duration, 'first': first, 'last': last}
+        for chunk_id, (start, end, duration, (first, last)) in enumerate(columns)
+    ]
+    for chunk in metadata:
+        if np.isnan(chunk['end']) and chunk['last'] > chunk['first']:
+            # Migrated before missing legacy ends were filled in
+            last_entry = entries[chunk['last'] - 1]
+            chunk['end'] = last_entry['start'] + last_entry['duration']
+    return metadata, entries, read_embeddings(folder, manifest)
+
+
+def read_index(folder, embeddings, rerank_factor=4):
+    """The stored compressed index, or an exact search over the memory-mapped embeddings."""
+    path = os.path.join(folder, 'index.faiss')
+    if os.path.exists(path):
+        with open(os.path.join(folder, 'manifest.json')) as f:
+            index_type = json.load(f)['index_type']
+        return RerankIndex(faiss.read_index(path), embeddings, rerank_factor, index_type)
+    return MemmapFlatIndex(embeddings)
+
+
+def new_compressed_index(index_type, training_vectors, nlist=None, pq_m=256):
+    """
+    Empty, trained index of one of the compressed ``INDEX_TYPES``.
+
+    For IVF-PQ, ``nlist`` defaults to ~4 sqrt(n) lists, and both the list count
+    and the bits per PQ code shrink when there are too few training vectors.
+    With a single vector, which cannot train even 1-bit codes, it falls back
+    to ``sq8``. ``pq_m`` is lowered to the nearest divisor of the dimension.
+    """
+    training_vectors = np.ascontiguousarray(training_vectors, dtype=np.float32)
+    count, dim = training_vectors.shape
+    if index_type == 'ivfpq' and count < 2:
+        index = faiss.index_factory(dim, INDEX_TYPES['sq8'])
+    elif index_type in ('sq16', 'sq8'):
+        index = faiss.index_factory(dim, INDEX_TYPES[index_type])
+    elif index_type == 'ivfpq':
+        nlist = max(1, min(nlist or int(4 * np.sqrt(count)), count // 39))
+        m = max(m for m in range(1, min(pq_m, dim) + 1) if dim % m == 0)
+        # 2 ** nbits centroids per sub-quantizer, which needs as many training vectors
+        nbits = min(8, int(np.log2(count)))
+        index = faiss.index_factory(dim, INDEX_TYPES[index_type].format(nlist=nlist, m=m, nbits=nbits))
+        index.nprobe = min(16, nlist)
+    else:
+        raise ValueError(f"Unknown compressed index type: {index_type}")
+    index.train(training_vectors)
+    return index
+
+
+def rerank(queries, candidates, vectors_for, k):
+    """
+    Exact L2 re-ranking of each query's candidate ids.
+
+    :param vectors_for: Maps a sorted array of ids to their float32 vectors.
+    :return: ``(distances, indices)`` shaped ``(len(queries), k)``, padded with -1 ids like faiss.
+    """
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    indices = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, (query, ids) in enumerate(zip(queries, candidates)):
+        # Sorted ids read memory-mapped rows in file order
+        ids = np.unique(ids[ids >= 0])
+        if not len(ids):
+            continue
+        exact = ((np.asarray(vectors_for(ids), dtype=np.float32) - query) ** 2).sum(axis=1)
+        best = np.argsort(exact, kind='stable')[:k]
+        distances[row, :len(best)] = exact[best]
+        indices[row, :len(best)] = ids[best]
+    return distances, indices
+
+
+class RerankIndex:
+    """
+    A compressed faiss index whose top ``k * rerank_factor`` candidates are
+    re-ranked with exact distances against the float32 embeddings (usually a
+    memory map, of which only the candidate rows are read).
+    ``rerank_factor=0`` returns the compressed index's own ranking.
+    """
+
+    def __init__(self, index, embeddings, rerank_factor=4, index_type=None):
+        self.index = index
+        self.embeddings = embeddings
+        self.rerank_factor = rerank_factor
+        self.index_type = index_type
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def d(self):
+        return self.index.d
+
+    def search(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if not self.rerank_factor:
+            return self.index.search(queries, k)
+        _, candidates = self.index.search(queries, max(k, min(self.ntotal, k * self.rerank_factor)))
+        return rerank(queries, candidates, lambda ids: self.embeddings[ids], k)
+
+
+class MemmapFlatIndex:
+    """
+    Exact L2 search straight over an embeddings array (usually a read-only
+    memory map), with the ``search``/``ntotal`` interface of ``IndexFlatL2``.
+    Opening a video this way never copies its matrix into the heap.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    @property
+    def ntotal(self):
+        return len(self.embeddings)
+
+    @property
+    def d(self):
+        return self.embeddings.shape[1]
+
+    def search(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        distances, indices = faiss.knn(queries, self.embeddings, min(k, self.ntotal))
+        if indices.shape[1] < k:
+            # Match IndexFlatL2, which pads missing results with -1
+            pad = k - indices.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+            indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+        return distances, indices
+
+
 class Faiss:
-    def __init__(self, model_name='Alibaba-NLP/gte-large-en-v1.5', chunk_duration=120, overlap_duration=40):
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-        self.model = AutoModel.from_pretrained(model_name, trust_remote_code=True)
+    def __init__(self, model_name='Alibaba-NLP/gte-large-en-v1.5', chunk_duration=120, overlap_duration=40,
+                 batch_size=16, exact_padding=True, num_threads=None, library=None, query_cache_size=1024,
+                 index_type='flat', rerank_factor=4):
+        # The tokenizer and model (and torch/transformers) load on first use,
+        # so opening already embedded videos never pays for them
+        self.model_name = model_name
+        self.num_threads = num_threads
+        self._tokenizer = None
+        self._model = None
+
+        # Embedding batches: with exact_padding every batch is padded to the
+        # longest text, which keeps vectors identical to a single forward pass
+        # (mean pooling includes padding positions). Without it, texts are
+        # bucketed by length and pooled over real tokens only, which wastes
+        # less compute but changes the vectors of previously cached videos.
+        self.batch_size = batch_size
+        self.exact_padding = exact_padding
 
         self.chunk_duration = chunk_duration
         self.overlap_duration = overlap_duration
+
+        # Index type for newly embedded videos (see INDEX_TYPES); compressed
+        # types re-rank rerank_factor * k candidates against the float32 vectors
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
+        self.index_type = index_type
+        self.rerank_factor = rerank_factor
         self.index = None
         self.metadata = []
+        # Transcript entries the chunks in self.metadata point into
+        self.entries = []
         self.embeddings = None
         self.video_id = None
 
+        # Interval index over self.metadata, see _build_interval_index
+        self._order = []
+        self._starts = []
+        self._max_ends = []
+
         # Ensure the embeddings directory exists
         self.base_dir = 'embeddings'
         os.makedirs(self.base_dir, exist_ok=True)
 
-    def _create_embeddings(self, texts):
-        inputs = self.tokenizer(texts, padding=True, truncation=True, return_tensors='pt')
-        with torch.no_grad():
-            embeddings = self.model(**inputs).last_hidden_state.mean(dim=1).cpu().numpy()
+        # Optional LibraryIndex that newly embedded videos are added to
+        self.library = library
+
+        # LRU of query embeddings keyed by (model_name, text)
+        self.query_cache = OrderedDict()
+        self.query_cache_size = query_cache_size
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name, trust_remote_code=True)
+        return self._tokenizer
+
+    @property
+    def model(self):
+        if self._model is None:
+            import torch
+            from transformers import AutoModel
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)
+            self._model = AutoModel.from_pretrained(self.model_name, trust_remote_code=True)
+            self._model.eval()
+        return self._model
+
+    def _token_lengths(self, texts):
+        return [len(ids) for ids in self.tokenizer(texts, truncation=True)['input_ids']]
+
+    def _create_embeddings(self, texts, exact_padding=None, pad_to=0):
+        """
+        :param pad_to: With exact padding, pad to at least this many tokens, e.g.
+            the longest chunk of a video whose other rows are already stored.
+        """
+        import torch
+
+        if exact_padding is None:
+            exact_padding = self.exact_padding
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+        encoded = self.tokenizer(texts, truncation=True)
+        lengths = [len(ids) for ids in encoded['input_ids']]
+        longest = max(max(lengths), pad_to)
+        # Length-sorted order, so each batch holds texts of similar size
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        embeddings = None
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                features = self.tokenizer.pad(
+                    {key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+                    padding='max_length',
+                    max_length=longest if exact_padding else max(lengths[i] for i in batch),
+                    return_tensors='pt'
+                )
+                hidden = self.model(**features).last_hidden_state
+                if exact_padding:
+                    pooled = hidden.mean(dim=1)
+                else:
+                    mask = features['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1)
+
+                if embeddings is None:
+                    embeddings = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+                embeddings[batch] = pooled.cpu().numpy()
+
+        if len(texts) > 1:
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"Embedded {len(texts)} chunks in {time.perf_counter() - wall_start:.1f}s "
+                  f"(CPU {time.process_time() - cpu_start:.1f}s, peak RSS {peak_mb:.0f} MB)")
         return embeddings
 
-    def _chunk_transcript(self, transcripts):
+    def _embed_queries(self, queries):
+        """
+        Embeddings of ``queries``, computing only those missing from the query cache.
+
+        Queries are pooled over their own tokens, so a query embedded in a
+        batch gets the same vector as when embedded alone.
+        """
+        keys = [(self.model_name, query) for query in queries]
+        missing = list(dict.fromkeys(key for key in keys if key not in self.query_cache))
+        if missing:
+            embeddings = self._create_embeddings([query for _, query in missing], exact_padding=False)
+            for key, embedding in zip(missing, embeddings):
+                self.query_cache[key] = embedding
+
+        for key in keys:
+            self.query_cache.move_to_end(key)
+        result = np.stack([self.query_cache[key] for key in keys])
+        while len(self.query_cache) > self.query_cache_size:
+            self.query_cache.popitem(last=False)
+        return result
+
+    def _chunk_transcript(self, transcripts, prefilled=0):
+        """
+        Split transcript entries into chunks of about ``chunk_duration`` seconds,
+        each starting with the last ``overlap_duration`` seconds of the previous one.
+
+        :param prefilled: Number of leading entries that are the overlap carried
+            over from an earlier chunk; like any overlap, they cannot close the
+            first chunk on their own.
+        :return: Chunk dicts pointing at ``transcripts[first:last]``.
+        """
         chunks = []
-        current_chunk = {
-            'text': '',
-            'start': transcripts[0]['start'],
-            'end': None,
-            'duration': 0,
-            'original_transcripts': []
-        }
-        overlap_duration = 0
-        overlap_buffer = []
+        first = 0
+        start = transcripts[0]['start']
+        end = None
+        duration = 0
 
-        for transcript in transcripts:
-            current_chunk['text'] += transcript['text'] + ' '
-            current_chunk['duration'] += transcript['duration']
-            current_chunk['end'] = transcript['start'] + transcript['duration']
-            current_chunk['original_transcripts'].append(transcript)
+        for position, transcript in enumerate(transcripts):
+            duration += transcript['duration']
+            end = transcript['start'] + transcript['duration']
 
-            if current_chunk['duration'] >= self.chunk_duration:
-                chunks.append(current_chunk.copy())
+            if duration >= self.chunk_duration and position >= prefilled:
+                chunks.append({'id': len(chunks), 'start': start, 'end': end, 'duration': duration,
+                               'first': first, 'last': position + 1})
 
-                # Prepare overlap buffer
-                overlap_buffer = []
+                # The next chunk starts with the shortest tail of this one
+                # lasting at least overlap_duration
+                chunk_first, first = first, position + 1
                 overlap_duration = 0
-                for buffer_item in reversed(current_chunk['original_transcripts']):
-                    overlap_buffer.insert(0, buffer_item)
-                    overlap_duration += buffer_item['duration']
+                while first > chunk_first:
+                    first -= 1
+                    overlap_duration += transcripts[first]['duration']
                     if overlap_duration >= self.overlap_duration:
                         break
 
-                current_chunk = {
-                    'text': '',
-                    'start': overlap_buffer[0]['start'],
-                    'end': None,
-                    'duration': 0,
-                    'original_transcripts': []
-                }
-
-                # Pre-fill current_chunk with overlap_buffer content
-                for item in overlap_buffer:
-                    current_chunk['text'] += item['text'] + ' '
-                    current_chunk['duration'] += item['duration']
-                    current_chunk['original_transcripts'].append(item)
+                start = transcripts[first]['start']
+                duration = 0
+                for item in transcripts[first:position + 1]:
+                    duration += item['duration']
 
         # Add remaining chunk if it exists
-        if current_chunk['duration'] > 0:
-            chunks.append(current_chunk.copy())
+        if duration > 0:
+            chunks.append({'id': len(chunks), 'start': start, 'end': end, 'duration': duration,
+                           'first': first, 'last': len(transcripts)})
 
         return chunks
 
+    def chunk(self, chunk_id):
+        """Full view of a chunk: its text and ``original_transcripts`` entries alongside the times."""
+        chunk = self.metadata[chunk_id]
+        entries = self.entries[chunk['first']:chunk['last']]
+        return {
+            'id': chunk['id'],
+            'text': chunk_text(entries),
+            'start': chunk['start'],
+            'end': chunk['end'],
+            'duration': chunk['duration'],
+            'original_transcripts': entries,
+        }
+
     def _save_data(self):
         if self.video_id:
             folder = os.path.join(self.base_dir, self.video_id)
-            os.makedirs(folder, exist_ok=True)
-
-            # Save metadata using pickle
-            with open(os.path.join(folder, 'metadata.pkl'), 'wb') as f:
-                pickle.dump(self.metadata, f)
-
-            # Save embeddings using pickle
-            with open(os.path.join(folder, 'embeddings.pkl'), 'wb') as f:
-                pickle.dump(self.embeddings, f)
+            write_video_data(folder, self.metadata, self.entries, self.embeddings, self.index,
+                             exact_padding=self.exact_padding)
 
     def _load_data(self, video_id):
         folder = os.path.join(self.base_dir, video_id)
-        if os.path.exists(folder):
-            # Load metadata using pickle
-            with open(os.path.join(folder, 'metadata.pkl'), 'rb') as f:
-                self.metadata = pickle.load(f)
-
-            # Load embeddings using pickle
-            with open(os.path.join(folder, 'embeddings.pkl'), 'rb') as f:
-                self.embeddings = pickle.load(f)
-
-            self.index = faiss.IndexFlatL2(self.embeddings.shape[1])
-            self.index.add(self.embeddings)
+        if has_video_data(folder):
+            self.metadata, self.entries, self.embeddings = read_video_data(folder)
+            self.index = read_index(folder, self.embeddings, self.rerank_factor)
+            self._build_interval_index()
 
             self.video_id = video_id
             return True
         return False
 
-    def add_transcripts(self, transcripts, video_id):
+    def add_transcripts(self, transcripts, video_id, incremental=False):
+        """
+        Chunk, embed and store a video's transcript; videos embedded before are loaded instead.
+
+        :param incremental: For transcripts that grow or get re-fetched: if the
+            video is already stored, re-chunk from the start of its last chunk
+            and embed only chunks that are new or changed.
+        """
         self.video_id = video_id
         
-        if not self._load_data(video_id):
-            chunks = self._chunk_transcript(transcripts)
+        if self._load_data(video_id):
+            if incremental:
+                self._update_transcripts(transcripts)
+            return
+
+        chunks = self._chunk_transcript(transcripts)
+
+        texts = [chunk_text(transcripts[chunk['first']:chunk['last']]) for chunk in chunks]
+        self.embeddings = self._create_embeddings(texts)
+
+        self.index = self._build_index(self.embeddings)
+        self.metadata = chunks
+        self.entries = transcripts
+        self._build_interval_index()
+        self._save_data()
+        if self.library is not None:
+            self.library.add_video(video_id, self.embeddings, self.metadata, first_chunk=0,
+                                   exact_padding=self.exact_padding)
+            self.library.save()
+
+    def _build_index(self, embeddings):
+        if self.index_type == 'flat':
+            return MemmapFlatIndex(embeddings)
+        index = new_compressed_index(self.index_type, embeddings)
+        index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+        return RerankIndex(index, embeddings, self.rerank_factor, self.index_type)
+
+    def _update_transcripts(self, transcripts):
+        """
+        Bring the loaded video up to date with ``transcripts``.
+
+        Re-chunking from the last stored chunk's first entry, with its overlap
+        from the previous chunk marked as prefilled, reproduces exactly what
+        chunking the whole transcript would give from there on. With exact
+        padding the new rows are padded to the video's longest chunk, so they
+        match a full re-embed as well.
+        """
+        def entry_key(entry):
+            return entry['start'], entry['duration'], entry['text']
+
+        def rebuild(reason):
+            print(f"{reason}, re-embedding {self.video_id}")
+            os.remove(os.path.join(self.base_dir, self.video_id, 'manifest.json'))
+            self.add_transcripts(transcripts, self.video_id)
+
+        folder = os.path.join(self.base_dir, self.video_id)
+        # Manifests from before pooling was recorded were written with exact padding
+        if read_manifest(folder).get('exact_padding', True) != self.exact_padding:
+            rebuild("Stored vectors use the other pooling")
+            return
+
+        last = self.metadata[-1]
+        first = last['first']
+        # Entries of the earlier chunks, which keep their vectors
+        kept = max([first] + [chunk['last'] for chunk in self.metadata[-2:-1]])
+        if len(transcripts) < max(kept, first + 1) or any(
+            entry_key(a) != entry_key(b) for a, b in zip(self.entries[:kept], transcripts)
+        ):
+            rebuild("Transcript changed before its last chunk")
+            return
+
+        tail = self._chunk_transcript(transcripts[first:], prefilled=kept - first)
+        for chunk_id, chunk in enumerate(tail, start=last['id']):
+            chunk['id'] = chunk_id
+            chunk['first'] += first
+            chunk['last'] += first
+
+        # The last stored chunk keeps its vector if its entries did not change
+        unchanged = (
+            all(tail[0][key] == last[key] for key in ('start', 'end', 'duration', 'first', 'last'))
+            and [entry_key(e) for e in transcripts[first:last['last']]]
+            == [entry_key(e) for e in self.entries[first:last['last']]]
+        )
+        if unchanged:
+            tail = tail[1:]
+        if not tail:
+            return
+
+        rows_from = tail[0]['id']
+        texts = [chunk_text(transcripts[chunk['first']:chunk['last']]) for chunk in tail]
+        pad_to = 0
+        if self.exact_padding:
+            # A full re-embed pads every chunk to the longest one; the stored rows
+            # were padded to the old longest, so they only stay valid if it is unchanged
+            stored = self._token_lengths(
+                [chunk_text(self.entries[chunk['first']:chunk['last']]) for chunk in self.metadata]
+            )
+            pad_to = max(stored)
+            if max(stored[:rows_from] + self._token_lengths(texts)) != pad_to:
+                rebuild("Longest chunk changed")
+                return
+        embeddings = self._create_embeddings(texts, pad_to=pad_to)
+        self.metadata = self.metadata[:rows_from] + tail
+        self.entries = transcripts
 
-            texts = [chunk['text'] for chunk in chunks]
-            self.embeddings = self._create_embeddings(texts)
+        if isinstance(self.index, RerankIndex):
+            # Compressed codes keep the quantizer trained on the first version
+            self.index.index.remove_ids(faiss.IDSelectorRange(rows_from, self.index.ntotal))
+            self.index.index.add(embeddings)
 
-            if self.index is None:
-                dim = self.embeddings.shape[1]
-                self.index = faiss.IndexFlatL2(dim)
+        write_video_data(folder, self.metadata, self.entries, embeddings, self.index, rows_from=rows_from,
+                         exact_padding=self.exact_padding)
+        self.embeddings = read_embeddings(folder)
+        self.index.embeddings = self.embeddings
+        self._build_interval_index()
+        print(f"Updated {self.video_id}: {len(tail)} chunks re-embedded, {len(self.metadata)} in total")
 
-            self.index.add(self.embeddings)
-            self.metadata.extend(chunks)
-            self._save_data()
+        if self.library is not None:
+            self.library.add_video(self.video_id, embeddings, tail, first_chunk=rows_from,
+                                   exact_padding=self.exact_padding)
+            self.library.save()
 
     def search(self, query, k=5):
-        # Create query embedding
-        query_embedding = self._create_embeddings([query])
-        
-        # Perform search
-        distances, indices = self.index.search(query_embedding, k)
-        
-        # Retrieve metadata
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries, k=5):
+        """
+        Search several queries with one batched embedding pass and one index search.
+
+        :return: One list of ``{'distance', 'metadata'}`` results per query.
+        """
+        if not queries:
+            return []
+        query_embeddings = self._embed_queries(queries)
+        distances, indices = self.index.search(query_embeddings, k)
+
         results = []
-        for i in range(k):
-            index = indices[0][i]
-            results.append({
-                'distance': distances[0][i],
-                'metadata': self.metadata[index]
-            })
-        
+        for row_distances, row_indices in zip(distances, indices):
+            results.append([
+                {'distance': distance, 'metadata': self.chunk(index)}
+                for distance, index in zip(row_distances, row_indices)
+                if index >= 0
+            ])
         return results
 
+    def _build_interval_index(self):
+        """
+        Sort chunk ids by start time and keep a running maximum of end times,
+        so the chunks overlapping any interval form one contiguous run that
+        two binary searches locate.
+        """
+        self._order = sorted(range(len(self.metadata)), key=lambda i: self.metadata[i]['start'])
+        self._starts = [self.metadata[i]['start'] for i in self._order]
+        self._max_ends = []
+        max_end = float('-inf')
+        for i in self._order:
+            max_end = max(max_end, self.metadata[i]['end'])
+            self._max_ends.append(max_end)
+
+    def overlapping(self, start, end):
+        """Ids of the chunks overlapping ``(start, end)``, in start order."""
+        # Chunks starting at or after `end` cannot overlap, and neither can
+        # any chunk before the first position whose running max end passes `start`
+        lo = bisect_right(self._max_ends, start)
+        hi = bisect_left(self._starts, end)
+        return [
+            i for i in self._order[lo:hi]
+            if self.metadata[i]['end'] > start
+        ]
+
     def find_neighbors(self, target_chunk):
         """
         Find neighboring chunks of a given chunk.
 
-        :param target_chunk: The chunk object for which to find neighbors.
+        :param target_chunk: The chunk object, or its integer ``id``, for which to find neighbors.
         :return: A list of neighboring chunks' metadata.
         """
-        if target_chunk not in self.metadata:
+        chunk_id = target_chunk if isinstance(target_chunk, int) else target_chunk.get('id')
+        if chunk_id is None:
+            # Chunks saved before they carried an id (e.g. in an LLM response cache)
+            chunk_id = next(
+                (chunk['id'] for chunk in self.metadata
+                 if chunk['start'] == target_chunk.get('start') and chunk['end'] == target_chunk.get('end')),
+                None,
+            )
+        if chunk_id is None or not 0 <= chunk_id < len(self.metadata):
             raise ValueError("Chunk not found in metadata.")
-        
-        chunk_index = self.metadata.index(target_chunk)
-        neighbors = []
 
-        for i, chunk in enumerate(self.metadata):
-            if i == chunk_index:
+        target = self.metadata[chunk_id]
+        return [
+            self.chunk(i)
+            for i in self.overlapping(target['start'], target['end'])
+            if i != chunk_id
+        ]
+
+
+class LibraryIndex:
+    """
+    Persistent approximate nearest neighbour index over every video in ``embeddings/``.
+
+    Vector ``i`` of the index belongs to chunk ``chunk_ids[i]`` of video
+    ``video_ids[video_codes[i]]``; chunk start/end times are kept alongside so
+    results can be turned into clips without loading each video.
+
+    :param index_type: ``'hnsw'`` (graph, no training), ``'ivf'`` (inverted
+        lists), or the compressed ``'hnsw_sq8'`` (1 byte per dimension) and
+        ``'ivfpq'`` (``pq_m`` bytes per vector). Compressed types re-rank
+        ``rerank_factor * k`` candidates with the float32 vectors of each video.
+    :param embedder: Object with ``_embed_queries`` (e.g. ``Faiss``), needed
+        to search with text queries.
+    :param min_training: Vectors needed before the trained types (all but
+        ``'hnsw'``) are trained, ``39 * nlist`` by default; until then vectors
+        go into an exact flat index.
+    :param retrain_growth: Trained indexes are retrained on all live vectors
+        once the library is this many times larger than their training set.
+
+    All videos in the index share one pooling mode (``exact_padding``), taken
+    from the first video added; videos pooled the other way are refused.
+    """
+
+    def __init__(self, base_dir='embeddings', index_type='hnsw', embedder=None,
+                 hnsw_m=32, ef_search=128, nlist=1024, nprobe=32, exact_filter_limit=50000,
+                 pq_m=256, rerank_factor=4, min_training=None, retrain_growth=2):
+        self.base_dir = base_dir
+        self.folder = os.path.join(base_dir, LIBRARY_DIR)
+        self.index_type = index_type
+        self.embedder = embedder
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank_factor = rerank_factor
+        # Filters matching at most this many vectors are searched exactly
+        self.exact_filter_limit = exact_filter_limit
+        self.min_training = min_training or 39 * nlist
+        self.retrain_growth = retrain_growth
+
+        self.index = None
+        # Number of vectors the current index was trained on, 0 while untrained
+        self.trained_on = 0
+        self.exact_padding = None
+        self.video_ids = []
+        self._video_codes = {}
+        self.video_codes = np.zeros(0, dtype=np.int32)
+        self.chunk_ids = np.zeros(0, dtype=np.int32)
+        self.starts = np.zeros(0, dtype=np.float32)
+        self.ends = np.zeros(0, dtype=np.float32)
+
+        self.load()
+
+    def _new_index(self, dim, training_vectors):
+        if self.index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+            index.hnsw.efSearch = self.ef_search
+            return index
+        if len(training_vectors) < self.min_training:
+            # Too few vectors to train on: search exactly until there are enough
+            self.trained_on = 0
+            return faiss.IndexFlatL2(dim)
+        self.trained_on = len(training_vectors)
+        if self.index_type == 'ivf':
+            # Keep ~39 training points per list, as faiss recommends
+            nlist = max(1, min(self.nlist, len(training_vectors) // 39))
+            index = faiss.index_factory(dim, f'IVF{nlist},Flat')
+            index.train(training_vectors)
+            # Lets filtered searches reconstruct vectors by id
+            index.make_direct_map()
+            index.nprobe = min(self.nprobe, nlist)
+            return index
+        if self.index_type == 'hnsw_sq8':
+            index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, self.hnsw_m)
+            index.train(training_vectors)
+            index.hnsw.efSearch = self.ef_search
+            return index
+        if self.index_type == 'ivfpq':
+            index = new_compressed_index('ivfpq', training_vectors, self.nlist, self.pq_m)
+            index.make_direct_map()
+            index.nprobe = min(self.nprobe, index.nlist)
+            return index
+        raise ValueError(f"Unknown library index type: {self.index_type}")
+
+    def load(self):
+        index_path = os.path.join(self.folder, 'index.faiss')
+        if not os.path.exists(index_path):
+            return False
+        self.index = faiss.read_index(index_path)
+        with open(os.path.join(self.folder, 'videos.json')) as f:
+            manifest = json.load(f)
+        self.index_type = manifest['index_type']
+        self.exact_padding = manifest.get('exact_padding', True)
+        self.trained_on = manifest.get('trained_on', 0 if self.untrained else self.index.ntotal)
+        self.video_ids = manifest['video_ids']
+        self._video_codes = {video_id: i for i, video_id in enumerate(self.video_ids)}
+        self.video_codes = np.load(os.path.join(self.folder, 'video_codes.npy'))
+        self.chunk_ids = np.load(os.path.join(self.folder, 'chunk_ids.npy'))
+        self.starts = np.load(os.path.join(self.folder, 'starts.npy'))
+        self.ends = np.load(os.path.join(self.folder, 'ends.npy'))
+        if hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = self.ef_search
+        return True
+
+    def save(self):
+        if self.index is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(self.folder, 'index.faiss'))
+        with open(os.path.join(self.folder, 'videos.json'), 'w') as f:
+            json.dump({'index_type': self.index_type, 'exact_padding': self.exact_padding,
+                       'trained_on': self.trained_on, 'video_ids': self.video_ids}, f)
+        np.save(os.path.join(self.folder, 'video_codes.npy'), self.video_codes)
+        np.save(os.path.join(self.folder, 'chunk_ids.npy'), self.chunk_ids)
+        np.save(os.path.join(self.folder, 'starts.npy'), self.starts)
+        np.save(os.path.join(self.folder, 'ends.npy'), self.ends)
+
+    def __contains__(self, video_id):
+        return video_id in self._video_codes
+
+    def add_video(self, video_id, embeddings, metadata, first_chunk=None, exact_padding=True):
+        """
+        Append one video's chunk vectors.
+
+        :param first_chunk: Id of the first chunk in ``embeddings``/``metadata``.
+            When given, vectors the video already has from that chunk on are
+            retired and replaced by these; when None, indexed videos are skipped.
+        :param exact_padding: Pooling the vectors were made with; must match the index's.
+        """
+        if len(metadata) == 0 or (video_id in self and first_chunk is None):
+            return False
+        if self.exact_padding is None:
+            self.exact_padding = exact_padding
+        elif exact_padding != self.exact_padding:
+            raise ValueError(
+                f"{video_id} was embedded with exact_padding={exact_padding}, "
+                f"but the library index uses exact_padding={self.exact_padding}"
+            )
+        first_chunk = first_chunk or 0
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.index is None:
+            self.index = self._new_index(embeddings.shape[1], embeddings)
+
+        if video_id in self:
+            self.remove_chunks(video_id, first_chunk)
+            code = self._video_codes[video_id]
+        else:
+            code = len(self.video_ids)
+            self.video_ids.append(video_id)
+            self._video_codes[video_id] = code
+
+        self.index.add(embeddings)
+        count = len(embeddings)
+        self.video_codes = np.concatenate([self.video_codes, np.full(count, code, dtype=np.int32)])
+        self.chunk_ids = np.concatenate([self.chunk_ids, np.arange(first_chunk, first_chunk + count, dtype=np.int32)])
+        self.starts = np.concatenate([self.starts, np.array([c['start'] for c in metadata], dtype=np.float32)])
+        self.ends = np.concatenate([self.ends, np.array([c['end'] for c in metadata], dtype=np.float32)])
+        self._maybe_retrain()
+        return True
+
+    @property
+    def untrained(self):
+        """True while a trained index type still holds its vectors in a flat index."""
+        return isinstance(self.index, faiss.IndexFlat)
+
+    def _maybe_retrain(self):
+        """Train, or retrain, on every live vector once there are enough or the library has grown."""
+        if self.index_type == 'hnsw':
+            return
+        live = np.flatnonzero(self.video_codes >= 0)
+        if len(live) < self.min_training:
+            return
+        if not self.untrained and len(live) < self.retrain_growth * self.trained_on:
+            return
+
+        vectors = self.exact_vectors(live) if self.compressed else self.index.reconstruct_batch(live)
+        self.index = self._new_index(vectors.shape[1], vectors)
+        self.index.add(vectors)
+        # Retired vectors are dropped while rebuilding
+        self.video_codes = self.video_codes[live]
+        self.chunk_ids = self.chunk_ids[live]
+        self.starts = self.starts[live]
+        self.ends = self.ends[live]
+        print(f"Trained the library index on {len(live)} vectors")
+
+    def remove_chunks(self, video_id, first_chunk=0):
+        """
+        Retire a video's vectors from ``first_chunk`` on. Graph indexes cannot
+        delete vectors, so retired ones keep their slot with video code -1 and
+        are skipped in results.
+        """
+        if video_id not in self:
+            return
+        retired = (self.video_codes == self._video_codes[video_id]) & (self.chunk_ids >= first_chunk)
+        self.video_codes[retired] = -1
+
+    def sync(self):
+        """Add every video under ``base_dir`` that is not indexed yet, then save. Returns how many were added."""
+        pending = {
+            name: read_manifest(os.path.join(self.base_dir, name)).get('exact_padding', True)
+            for name in sorted(os.listdir(self.base_dir))
+            if name != LIBRARY_DIR and name not in self
+            and has_video_data(os.path.join(self.base_dir, name))
+        }
+        if self.exact_padding is None and pending:
+            self.exact_padding = next(iter(pending.values()))
+        for video_id, exact_padding in list(pending.items()):
+            if exact_padding != self.exact_padding:
+                print(f"Skipping {video_id}: embedded with exact_padding={exact_padding}, "
+                      f"the library index uses exact_padding={self.exact_padding}")
+                del pending[video_id]
+        if not pending:
+            return 0
+
+        if self.index is None and self.index_type != 'hnsw':
+            # Train the quantizers on everything that is about to be added
+            videos = [(video_id, *read_video_data(os.path.join(self.base_dir, video_id))) for video_id in pending]
+            training = np.concatenate([np.asarray(e, dtype=np.float32) for *_, e in videos])
+            self.index = self._new_index(training.shape[1], training)
+            for video_id, metadata, _, embeddings in videos:
+                self.add_video(video_id, embeddings, metadata, exact_padding=self.exact_padding)
+        else:
+            for video_id in pending:
+                metadata, _, embeddings = read_video_data(os.path.join(self.base_dir, video_id))
+                self.add_video(video_id, embeddings, metadata, exact_padding=self.exact_padding)
+
+        self.save()
+        return len(pending)
+
+    def _results(self, distances, indices):
+        results = []
+        for distance, i in zip(distances, indices):
+            if i < 0 or self.video_codes[i] < 0:
                 continue
+            results.append({
+                'distance': float(distance),
+                'video_id': self.video_ids[self.video_codes[i]],
+                'chunk_id': int(self.chunk_ids[i]),
+                'start': float(self.starts[i]),
+                'end': float(self.ends[i]),
+            })
+        return results
 
-            # Check if chunks overlap or are adjacent
-            if (
-                chunk['start'] < target_chunk['end'] and 
-                chunk['end'] > target_chunk['start']
-            ):
-                neighbors.append(chunk)
-        
-        return neighbors
+    @property
+    def compressed(self):
+        return self.index_type in ('hnsw_sq8', 'ivfpq') and not self.untrained
+
+    def exact_vectors(self, ids):
+        """Float32 vectors of index ids, read from each video's memory-mapped embeddings."""
+        vectors = np.zeros((len(ids), self.index.d), dtype=np.float32)
+        codes = self.video_codes[ids]
+        for code in np.unique(codes[codes >= 0]):
+            rows = np.flatnonzero(codes == code)
+            embeddings = read_embeddings(os.path.join(self.base_dir, self.video_ids[code]))
+            vectors[rows] = embeddings[self.chunk_ids[ids[rows]]]
+        return vectors
+
+    def search_vectors(self, query_embeddings, k=10, video_ids=None):
+        """
+        :param query_embeddings: ``(n, dim)`` float32 queries.
+        :param video_ids: Optional iterable of video ids to restrict the search to.
+        :return: One list of result dicts per query, best first.
+        """
+        queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if self.index is None:
+            return [[] for _ in queries]
+        rerank_factor = self.rerank_factor if self.compressed else 0
+        candidates = k * max(1, rerank_factor)
+
+        if video_ids is None:
+            # Ask for extra neighbours to make up for retired vectors
+            retired = int(np.count_nonzero(self.video_codes < 0))
+            distances, indices = self.index.search(queries, min(candidates + retired, self.index.ntotal))
+        else:
+            codes = [self._video_codes[v] for v in video_ids if v in self._video_codes]
+            ids = np.flatnonzero(np.isin(self.video_codes, codes)).astype(np.int64)
+            if len(ids) == 0:
+                return [[] for _ in queries]
+
+            if len(ids) <= self.exact_filter_limit:
+                # Small subsets: exact search over just those vectors
+                vectors = self.exact_vectors(ids) if self.compressed else self.index.reconstruct_batch(ids)
+                distances, positions = faiss.knn(queries, vectors, min(k, len(ids)))
+                indices = np.where(positions >= 0, ids[positions], -1)
+                return [self._results(d, i) for d, i in zip(distances, indices)]
+
+            selector = faiss.IDSelectorBatch(ids)
+            if self.untrained:
+                params = faiss.SearchParameters(sel=selector)
+            elif self.index_type.startswith('hnsw'):
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+            else:
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=self.index.nprobe)
+            distances, indices = self.index.search(queries, candidates, params=params)
+
+        if rerank_factor:
+            indices = np.where((indices >= 0) & (self.video_codes[indices] >= 0), indices, -1)
+            distances, indices = rerank(queries, indices, self.exact_vectors, k)
+        return [self._results(d, i)[:k] for d, i in zip(distances, indices)]
+
+    def search(self, query, k=10, video_ids=None):
+        """Best matching moments across the library for a text query."""
+        return self.search_many([query], k, video_ids)[0]
+
+    def search_many(self, queries, k=10, video_ids=None):
+        """Text queries embedded in one batch (through the embedder's query cache) and searched together."""
+        return self.search_vectors(self.embedder._embed_queries(queries), k, video_ids)
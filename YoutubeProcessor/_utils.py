@@ -1,75 +1,146 @@
-from moviepy.editor import VideoFileClip
-from groq import Groq
-import yt_dlp
-
-
 import os
 import subprocess
 import yt_dlp
+from concurrent.futures import ThreadPoolExecutor
+
+def rank_formats(formats):
+    # Formats carrying both video and audio, best quality first
+    return sorted(
+        [f for f in formats if f["vcodec"] != "none" and f["acodec"] != "none"],
+        key=lambda f: (f.get("height", 0), f.get("width", 0)),
+        reverse=True,
+    )
+
+def video_id_from_url(url):
+    # Resolve the video id from the URL alone, without a network request
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.ie_key() != "Generic" and ie.suitable(url):
+            return ie.get_temp_id(url)
+    return None
+
+def probe_source(url):
+    # Extract the video metadata once and pick the format to use.
+    # Returns (info, format_id, media_format); media_format is None when
+    # falling back to "best", which may not be a single downloadable file.
+    with yt_dlp.YoutubeDL() as ydl:
+        info = ydl.extract_info(url, download=False)
+    sorted_formats = rank_formats(info["formats"])
+
+    if len(sorted_formats) > 1:
+        # Second best quality
+        return info, sorted_formats[1]["format_id"], sorted_formats[1]
+    if sorted_formats:
+        # If there's only one format, fallback to the best available
+        return info, "best", sorted_formats[0]
+    return info, "best", None
+
+def download_video(url, base_filename, cache=None, probe=None):
+    # Download the second best quality video, returns the path of the local file.
+    # probe is the result of probe_source, when the caller already has it.
+    info, format_id, _ = probe or probe_source(url)
+
+    if cache is not None:
+        cached = cache.get(info["id"], format_id)
+        if cached:
+            print(f"Using cached source {cached}")
+            return cached
+        base_filename = cache.path(info["id"], format_id) + ".part"
 
-def download_video(url, base_filename):
-    # Download the second best quality video
     ydl_opts = {
-        "format": "bestvideo[ext=mp4]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo[height>240][ext=mp4]/best",  # Fallbacks for best quality selection
+        "format": format_id,
         "outtmpl": base_filename,  # Save as the base filename
     }
-
+    # Download from the already extracted metadata instead of probing again
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        formats = ydl.extract_info(url, download=False)["formats"]
-        sorted_formats = sorted(
-            [f for f in formats if f["vcodec"] != "none" and f["acodec"] != "none"],
-            key=lambda f: (f.get("height", 0), f.get("width", 0)),
-            reverse=True,
-        )
-
-        if len(sorted_formats) > 1:
-            # Set the format ID to the second best quality
-            ydl_opts["format"] = sorted_formats[1]["format_id"]
-        else:
-            # If there's only one format, fallback to the best available
-            ydl_opts["format"] = "best"
-
-        # Download the video using the selected format
-        ydl = yt_dlp.YoutubeDL(ydl_opts)
-        ydl.download([url])
-
-def trim_video(input_file, output_file, start_time, end_time):
-    # Use ffmpeg to trim the video
-    subprocess.run([
-        "ffmpeg", "-y",  # Overwrite output file if it exists
-        "-i", input_file,  # Input file
+        ydl.process_ie_result(info, download=True)
+
+    if cache is not None:
+        return cache.put(info["id"], format_id, base_filename)
+    return base_filename
+
+def trim_video(input_file, output_file, start_time, end_time, headers=None):
+    # Use ffmpeg to trim the video; input_file may be a local path or a URL.
+    # Seeking on the input side jumps straight to the keyframe before
+    # start_time instead of reading everything up to it, and over HTTP only
+    # the byte range covering the segment is requested.
+    cmd = ["ffmpeg", "-y", "-loglevel", "error"]  # Overwrite output file if it exists
+    if headers:
+        cmd += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    subprocess.run(cmd + [
         "-ss", str(start_time),  # Start time
-        "-to", str(end_time),  # End time
+        "-i", input_file,  # Input file
+        "-t", str(end_time - start_time),  # Duration
         "-c", "copy",  # Copy codec, no re-encoding
         output_file
-    ])
-
-def download_video_segments(url, segments, base_filename):
+    ], check=True)
+
+def trim_segments(input_file, segments, base_filename, headers=None, max_workers=4):
+    # Cut all segments with a bounded pool of concurrent ffmpeg processes.
+    # Returns the files that were cut; failed segments are reported and skipped.
+    files = [f"{base_filename}_segment_{i+1}.mp4" for i in range(len(segments))]
+    trimmed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        jobs = [
+            pool.submit(trim_video, input_file, segment_filename, segment['start_time'], segment['end_time'], headers)
+            for segment, segment_filename in zip(segments, files)
+        ]
+        for i, job in enumerate(jobs):
+            try:
+                job.result()
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Failed to trim segment {i+1}: {e}")
+                if os.path.exists(files[i]):
+                    os.remove(files[i])
+                continue
+            print(f"Trimmed segment {i+1} as {files[i]}")
+            trimmed.append(files[i])
+    if segments and not trimmed:
+        raise RuntimeError(f"Could not trim any segment of {input_file}")
+    return trimmed
+
+def download_video_segments(url, segments, base_filename, range_only=False, cache=None, max_workers=4):
     # Remove .mp4 extension if it exists
     if base_filename.endswith('.mp4'):
         base_filename = base_filename[:-4]
 
+    # A source already in the media cache only costs a local trim
+    if cache is not None:
+        video_id = video_id_from_url(url)
+        cached = cache.find(video_id) if video_id else None
+        if cached:
+            return trim_segments(cached, segments, base_filename, max_workers=max_workers)
+        if range_only and video_id and cache.requested(video_id) > 1:
+            # Clipped from before: cache the whole source once, so later clips are local trims
+            range_only = False
+
+    probe = probe_source(url)
+    media_format = probe[2]
+    if range_only:
+        if media_format is not None:
+            # Read only the segment ranges straight from the remote file
+            return trim_segments(
+                media_format["url"], segments, base_filename,
+                headers=media_format.get("http_headers"), max_workers=max_workers
+            )
+        print("No single-file format available for range download, downloading the full video")
+
     # Step 1: Download the full video
-    full_video_filename = f"{base_filename}_full.mp4"
-    download_video(url, full_video_filename)
+    full_video_filename = download_video(url, f"{base_filename}_full.mp4", cache, probe)
 
-    files = []
     # Step 2: Trim the video into segments
-    for i, segment in enumerate(segments):
-        segment_filename = f"{base_filename}_segment_{i+1}.mp4"
-        trim_video(full_video_filename, segment_filename, segment['start_time'], segment['end_time'])
-        files.append(segment_filename)
-        print(f"Trimmed segment {i+1} as {segment_filename}")
-
-    # Optionally: Remove the full video after trimming
-    os.remove(full_video_filename)
-
-    return files
+    try:
+        return trim_segments(full_video_filename, segments, base_filename, max_workers=max_workers)
+    finally:
+        # Remove the full video after trimming unless the cache owns it
+        if cache is None:
+            os.remove(full_video_filename)
 
 
 
 
 def segment_video(video_path, segments):
+    from moviepy.editor import VideoFileClip
+
     video = VideoFileClip(video_path)
     clip = []
     for i, segment in enumerate(segments):
@@ -55,3 +55,38 @@ Eg:Output: [2,8]. Which represents a range i.e start, finish. So only return 2 n
 
  DO NOT INCLUDE ANYTHING ELSE THE OUTPUT SHOULD ONLY BE THE SLICE, NO EXPLANATIONS. NO EXPLANATIONS. IT SHOULD BASICALLY BE A GOOD TIKTOK CLIP, SO PROVIDE ENOUGH CONTEXT AS WELL"""
 
+
+
+extract_wisdom_window="""
+# IDENTITY and PURPOSE
+
+You extract surprising, insightful, and interesting information from one part of a longer text. Your focus is on uncovering insights related to the purpose and meaning of life, human flourishing, the future role of technology, the impact of artificial intelligence on humanity, memes, learning, reading, books, continuous improvement, and similar topics.
+
+The input is split into numbered chunks, each starting with a marker like [C12].
+
+# STEPS
+
+- Extract up to {ideas} of the most surprising, insightful, and/or interesting ideas from the input into a section called IDEAS:.
+
+- Extract up to {quotes} of the most surprising, insightful, and/or interesting quotes from the input into a section called QUOTES:. Use the exact quote text from the input.
+
+- Extract up to {stories} of the most compelling stories from the input into a section called STORIES:. Summarize each story in less than 50 words, capturing the essence and key message.
+
+# OUTPUT INSTRUCTIONS
+
+- Provide all output in Markdown format, with each section title on its own line like # IDEAS: and one bullet per item.
+
+- Write IDEAS bullets as exactly 15 words.
+
+- End every bullet with the marker of the chunk it comes from, e.g. [C12].
+
+- Only extract what is actually in the input; fewer items are fine.
+
+- Do not repeat ideas, quotes, or stories.
+
+- Follow ALL these instructions precisely when creating your output.
+
+# INPUT
+
+INPUT:
+ {transcript_text}"""